@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# benchmark dtsparser on the bundled board dts files and on synthetic trees
+# scaled up 10x/100x, results are printed and can be saved as json to compare runs, Such as
+#    ./bench_dtsparser.py --scale 1 10 100 -o bench_output.json
+#    ./bench_dtsparser.py --compare bench_output.json
+#
+
+from argparse import ArgumentParser
+import os
+import json
+import time
+import platform
+import tempfile
+import contextlib
+import io
+import dtsparser
+
+BOARD_DTS_FILES = {
+    'qualcomm': 'sm8150-dtb-sm8150-sdx50m-mtp-overlay.dts',
+    'qualcomm-msm8940': 'msm8940-mtp.dts',
+    'mtk': 'mt6771-dtb-k71v1_64_bsp.dts',
+    'sprd': 'sp9863a-1h10-native-dtb-sp9863a-1h10-overlay.dts',
+}
+
+PATTERNS = ['interrupt-controller', 'gpio-controller', 'phandle = <0x8[01].*', 'pinctrl-[0-9]+ = <.*>',
+            'compatible = "qcom,.*"', 'status = "disabled"', '.*-gpios = .*']
+
+
+def make_synthetic_dts(scale=1):
+    """
+        Return qualcomm like dts text, node and phandle count grow linearly with scale:
+        scale gpio controllers with 32 pin groups each, 100 * scale devices using gpios,
+        interrupts and pinctrl of them
+    """
+    lines = ['/dts-v1/;', '', '/ {', '\tcompatible = "qcom,synthetic";', '\tinterrupt-parent = <0x1>;',
+             '\t#address-cells = <0x1>;', '\t#size-cells = <0x1>;', '', '\tsoc {',
+             '\t\tinterrupt-controller@17a00000 {', '\t\t\tcompatible = "arm,gic-v3";', '\t\t\tinterrupt-controller;',
+             '\t\t\t#interrupt-cells = <0x3>;', '\t\t\tphandle = <0x1>;', '\t\t};']
+    phandle = 1
+    controllers = []
+    for c in range(scale):
+        phandle += 1
+        controller = phandle
+        groups = []
+        lines += ['', '\t\tpinctrl@{:x} {{'.format(0x3000000 + c * 0x100000), '\t\t\tcompatible = "qcom,synthetic-pinctrl";',
+                  '\t\t\tgpio-controller;', '\t\t\t#gpio-cells = <0x2>;', '\t\t\tinterrupt-controller;',
+                  '\t\t\t#interrupt-cells = <0x2>;', '\t\t\tphandle = <{:#x}>;'.format(controller)]
+        for gpio in range(32):
+            phandle += 2
+            groups.append((gpio, phandle - 1, phandle))
+            lines += ['', '\t\t\tgroup_{} {{'.format(gpio), '', '\t\t\t\tactive {', '\t\t\t\t\tpins = "gpio{}";'.format(gpio),
+                      '\t\t\t\t\tfunction = "gpio";', '\t\t\t\t\tdrive-strength = <0x2>;', '\t\t\t\t\tbias-pull-up;',
+                      '\t\t\t\t\tphandle = <{:#x}>;'.format(phandle - 1), '\t\t\t\t};', '', '\t\t\t\tsleep {',
+                      '\t\t\t\t\tpins = "gpio{}";'.format(gpio), '\t\t\t\t\tfunction = "gpio";',
+                      '\t\t\t\t\tdrive-strength = <0x2>;', '\t\t\t\t\tbias-pull-down;',
+                      '\t\t\t\t\tphandle = <{:#x}>;'.format(phandle), '\t\t\t\t};', '\t\t\t};']
+        lines.append('\t\t};')
+        controllers.append((controller, groups))
+    for d in range(100 * scale):
+        controller, groups = controllers[d % scale]
+        gpio, active, sleep = groups[d % 32]
+        phandle += 1
+        lines += ['', '\t\tdevice@{:x} {{'.format(0x10000000 + d * 0x1000), '\t\t\tcompatible = "vendor,synthetic-device";',
+                  '\t\t\treg = <{:#x} 0x1000>;'.format(0x10000000 + d * 0x1000),
+                  '\t\t\tstatus = "{}";'.format('disabled' if d % 10 == 9 else 'okay'),
+                  '\t\t\tpinctrl-names = "default", "sleep";', '\t\t\tpinctrl-0 = <{:#x}>;'.format(active),
+                  '\t\t\tpinctrl-1 = <{:#x}>;'.format(sleep), '\t\t\tinterrupt-parent = <{:#x}>;'.format(controller),
+                  '\t\t\tinterrupts = <{:#x} 0x2>;'.format(gpio),
+                  '\t\t\treset-gpios = <{:#x} {:#x} 0x0>;'.format(controller, (gpio + 1) % 32),
+                  '\t\t\tphandle = <{:#x}>;'.format(phandle), '\t\t};']
+    lines += ['\t};', '};', '']
+    return '\n'.join(lines)
+
+
+def measure(func, repeat):
+    """
+        Return (min, mean) wall time of func in seconds, output printed by func is dropped
+    """
+    times = []
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return (min(times), sum(times) / len(times))
+
+
+def bench_file(name, filename, repeat):
+    """
+        Return list of result dict of benchmarks on filename
+    """
+    results = []
+    dts = dtsparser.Dts(filename)
+    nodes = list(dts.iter_nodes())
+    phandles = ['{:#x}'.format(node.cells('phandle')[0]) for node in nodes if node.cells('phandle')]
+    with contextlib.redirect_stdout(io.StringIO()):
+        pinctrlnodes = dts.get_pinctrlnode()
+
+    def phandle_lookups():
+        for phandle in phandles:
+            dts.find_node_by_phandle(phandle)
+
+    def pattern_queries():
+        for pattern in PATTERNS:
+            dts.find_node_statement_by_statementpattern(pattern)
+
+    def pinctrl_gpio_node_info():
+        for node in pinctrlnodes:
+            dts.get_pinctrl_gpio_node_info(node)
+
+    def lazy_find_node_by_phandle():
+        with dtsparser.LazyDts(filename) as lazy:
+            lazy.find_node_by_phandle(phandles[len(phandles) // 2])
+
+    benchmarks = [
+        ('parse', lambda: dtsparser.Dts(filename)),
+        ('lazy_find_node_by_phandle', lazy_find_node_by_phandle),
+        ('parse_with_disabled_node', lambda: dtsparser.Dts(filename, with_disabled_node=True)),
+        ('phandle_lookups', phandle_lookups),
+        ('pattern_queries', pattern_queries),
+        ('get_pinctrl_gpio_node_info', pinctrl_gpio_node_info),
+        ('dump_gpio_interrupt_pinctrl_usage', dts.dump_gpio_interrupt_pinctrl_usage),
+    ]
+    for benchmark, func in benchmarks:
+        best, mean = measure(func, repeat)
+        results.append({'file': name, 'benchmark': benchmark, 'nodes': len(nodes), 'phandles': len(phandles),
+                        'repeat': repeat, 'min': best, 'mean': mean})
+        print('{:<24} {:<36} {:>7} nodes {:>10.2f} ms'.format(name, benchmark, len(nodes), best * 1000))
+    return results
+
+
+def compare(old_results, new_results):
+    old = dict()
+    for result in old_results:
+        old[(result['file'], result['benchmark'])] = result
+    for result in new_results:
+        key = (result['file'], result['benchmark'])
+        if key in old:
+            ratio = result['min'] / old[key]['min'] if old[key]['min'] else float('inf')
+            print('{:<24} {:<36} {:>10.2f} ms -> {:>10.2f} ms {:>6.2f}x'.format(
+                key[0], key[1], old[key]['min'] * 1000, result['min'] * 1000, ratio))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark dtsparser on bundled dts files and synthetic trees")
+    parser.add_argument("--files", metavar='name', nargs='*', default=list(BOARD_DTS_FILES),
+                        help="Bundled dts files to benchmark, {}".format(', '.join(BOARD_DTS_FILES)))
+    parser.add_argument("--scale", metavar='N', nargs='*', type=int, default=[1, 10, 100],
+                        help="Scales of synthetic trees, nothing to skip them")
+    parser.add_argument("-r", "--repeat", metavar='N', type=int, default=3, help="Run each benchmark N times, minimum is kept")
+    parser.add_argument("-o", "--output", metavar='json_file', type=str, help="Save results as json")
+    parser.add_argument("--compare", metavar='json_file', type=str, help="Compare results with a previous json output")
+    command = parser.parse_args()
+
+    results = []
+    for name in command.files:
+        results += bench_file(name, os.path.join(os.path.dirname(os.path.abspath(__file__)), BOARD_DTS_FILES[name]),
+                              command.repeat)
+    for scale in command.scale:
+        fd, dtsfile = tempfile.mkstemp(suffix='.dts')
+        with os.fdopen(fd, 'w') as tfd:
+            tfd.write(make_synthetic_dts(scale))
+        try:
+            results += bench_file('synthetic-x{}'.format(scale), dtsfile, command.repeat)
+        finally:
+            os.unlink(dtsfile)
+
+    report = {'version': dtsparser.__version__, 'python': platform.python_version(),
+              'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    if command.output:
+        with open(command.output, 'w') as fd:
+            json.dump(report, fd, indent=1)
+    if command.compare:
+        with open(command.compare) as fd:
+            compare(json.load(fd)['results'], results)
@@ -2,6 +2,7 @@
 #Author: zhangbo10073794
 
 #dtsi_check.sh xxx.dts
+#print xxx.dts and its #include files depth first, include files are read once by dtsparser.py --includes
 
 #set -x
 
@@ -17,18 +18,9 @@ if [ ! -f $DTS ]; then
 	exit
 fi
 
-DIR=$(dirname $1)
-echo "$(basename $DTS)"
-
-function check()
-{
-	local a=$1
-	local files=$(grep "^[[:space:]]*#include[[:space:]]*\".*\"" $a | sed -E 's/[[:space:]]*#include[[:space:]]*"(.*)".*/\1/' -)
-	for item in $files
-	do
-		echo $item
-		check ${DIR}/$item
-	done
-}
+DTSPARSER=$(dirname $0)/dtsparser.py
+if [ ! -x $DTSPARSER ]; then
+	DTSPARSER=dtsparser.py
+fi
 
-check $DTS
+exec $DTSPARSER --includes $DTS
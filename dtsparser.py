@@ -12,36 +12,242 @@ import os
 import tempfile
 import sys
 import enum
+import bisect
+import struct
+import time
+import io
+import contextlib
+import itertools
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import pickle
+import zlib
+import cProfile
+import subprocess
+import mmap
+import json
+import csv
+import socket
+import socketserver
+import stat
+import threading
+
+__version__ = "2.0.0"
+
+# flattened device tree (dtb) format, see devicetree specification chapter 5
+FDT_MAGIC = 0xd00dfeed
+FDT_BEGIN_NODE = 0x1
+FDT_END_NODE = 0x2
+FDT_PROP = 0x3
+FDT_NOP = 0x4
+FDT_END = 0x9
+
+# one part of property value per match, group 1 is string, group 2 is cells, group 3 is bytes
+DTS_VALUE_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"|<([^>]*)>|\[([^\]]*)\]')
+DTS_STRING_ESCAPE_PATTERN = re.compile(r'\\(x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.)')
+DTS_STRING_ESCAPES = {'a': '\a', 'b': '\b', 't': '\t', 'n': '\n', 'v': '\v', 'f': '\f', 'r': '\r'}
+
+# one dts statement per match, group 1 is node or property name, group 2 is '{' of a node,
+# group 3 is property value, group 4 is end of node, comments, directives and labels have no group
+DTS_TOKEN_PATTERN = re.compile(r'''(?:
+      ([^\s{};=:"<\[/]+|/)\s*(?:(\{)|=\s*([^;"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^;"]*)*);|;)
+    | (\}\s*;)
+    | /\*.*?\*/ | //[^\n]*
+    | /[a-z][\w-]*/[^;{]*;
+    | [A-Za-z_]\w*:
+    )\s*''', re.VERBOSE | re.DOTALL)
+DTS_SPACE_PATTERN = re.compile(r'\s*')
+DTS_CHUNK_SIZE = 64 * 1024  # characters of dts text tokenized at once when it is read as a stream
+
+# pre-scan of LazyDts, braces are found first, then checked against strings and comments of their line
+DTS_LINE_SKIP_PATTERN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|/\*.*?\*/|//[^\n]*')
+DTS_PHANDLE_PATTERN = re.compile(rb'phandle\s*=\s*<\s*(0x[0-9a-fA-F]+|[0-9]+)\s*>')
+DTS_DISABLED_PATTERN = re.compile(rb'status\s*=\s*"disabled"')
+
+# Selector syntax, see Selector
+SELECTOR_REFERENCE_PATTERN = re.compile(r'(.*?)(?:(?:\s+|(?<=\]))@([^\s\[\]@/]+))?\s*', re.DOTALL)
+SELECTOR_STEP_PATTERN = re.compile(r'[^/\[\]\s]*')
+SELECTOR_FILTER_PATTERN = re.compile(r'\[\s*(!?)\s*([^\s\[\]=!~"]+)\s*(?:(=|!=|~=)\s*("(?:[^"\\]|\\.)*"|<[^>]*>|[^\]]*?))?\s*\]')
+
+# properties referencing nodes by phandle, they are compared by referenced node path in Dts.diff,
+# each phandle is followed by the number of cells given by the #cells property of referenced node,
+# #cells property is None if every cell is a phandle
+DTS_REFERENCE_PROPS = [
+    (r'interrupt-parent|pinctrl-[0-9]+|memory-region|msi-parent|remote-endpoint|.*-supply|nvmem-cells', None),
+    (r'(?:.*-)?gpios?', '#gpio-cells'),
+    (r'clocks|assigned-clocks|assigned-clock-parents', '#clock-cells'),
+    (r'resets', '#reset-cells'),
+    (r'power-domains', '#power-domain-cells'),
+    (r'dmas', '#dma-cells'),
+    (r'phys', '#phy-cells'),
+    (r'iommus', '#iommu-cells'),
+    (r'mboxes', '#mbox-cells'),
+    (r'interconnects', '#interconnect-cells'),
+    (r'io-channels', '#io-channel-cells'),
+    (r'thermal-sensors', '#thermal-sensor-cells'),
+    (r'cooling-device', '#cooling-cells'),
+    (r'interrupts-extended', '#interrupt-cells'),
+]
+DTS_REFERENCE_PATTERN = re.compile('|'.join(['({})'.format(pattern) for pattern, cells_prop in DTS_REFERENCE_PROPS]))
+
+# #include "file" of dts and dtsi files, group 1 is file, see IncludeGraph
+DTS_INCLUDE_PATTERN = re.compile(rb'^[ \t]*#include[ \t]*"(.*)"', re.MULTILINE)
+
+# gpio references in dts source lines, group 1 is gpio, see scan_gpio_sources
+# msm_gpio N followed by space, and gpN not followed by digit in pinctrl files
+DTS_GPIO_SOURCE_PATTERN = re.compile(rb'msm_gpio[ \t\r\f\v]*([0-9]+)(?=[ \t\r\f\v])')
+DTS_PINCTRL_SOURCE_PATTERN = re.compile(rb'gp[ \t\r\f\v]*([0-9]+)(?=[^0-9\n])')
+
+# gpio usage records, see Dts.iter_gpio_usage_records
+GPIO_USAGE_KINDS = ('gpio', 'interrupt', 'pinctrl')
+GPIO_RECORD_FIELDS = ['controller', 'gpio', 'kind', 'consumer', 'prop', 'config']
+GPIO_REPORT_FORMATS = {'text': '.txt', 'jsonl': '.jsonl', 'csv': '.csv'}  # {format: result file suffix}
 
-__version__ = "1.1.1"
 
 class Platform(enum.Enum):
     QUALCOMM = 1
     MTK = 2
     SPRD = 3
 
+    @classmethod
+    def from_compatible(cls, compatible_value):
+        """
+            return Platform of root compatible property value, None if it is unknown
+        """
+        if re.search(re.compile('(sprd)|(Spreadtrum)', re.IGNORECASE), compatible_value):
+            return cls.SPRD
+        elif re.search(re.compile('(mediatek)|(mtk)',re.IGNORECASE), compatible_value):
+            return cls.MTK
+        elif re.search(re.compile('qcom', re.IGNORECASE), compatible_value):
+            return cls.QUALCOMM
+
 
 class Node():
+    __slots__ = ('__props', '__values', '__shared', '__name', '__subnodes', '__parent')
+
     def __init__(self):
-        self.__propslist = []  # reg = <0x2>; saved as ['reg', '<0x2>']
-        self.__propsmap = None  # reg = <0x2>; saved as {'reg': '<0x2>'}
+        self.__props = dict()  # reg = <0x2>; saved as {'reg': '<0x2>'} in statement order
+        self.__values = None  # decoded props, reg = <0x2>; saved as {'reg': (2,)} when it is used
+        self.__shared = False  # props and values are shared with other nodes by NodeStore
         self.__name = None
         self.__subnodes = []
         self.__parent = None
-        self.__propschanged = 1
 
     def addstatement(self, statement):
         """
             property and value is stripped, property and value doesn't reserve end ';' character,
         """
-        statement = re.sub(re.compile('\s*;\s*\n*$'), '', statement)
-        if statement:
-            try:
-                i = statement.index('=')
-                self.__propslist.append([statement[0:i].strip(), statement[i+1:].strip()])
-            except:
-                self.__propslist.append([statement.strip(), ''])
-        self.__propschanged = 1
+        statement = statement.rstrip()
+        if statement.endswith(';'):
+            statement = statement[:-1]
+        prop, equal, value = statement.partition('=')
+        prop = prop.strip()
+        if prop:
+            self.addprop(prop, value.strip())
+
+    def addprop(self, prop, value):
+        """
+            prop and value are stripped str, value is '' for property without value,
+            value of an existing prop is replaced in place, prop and value are interned,
+            shared props are copied before they are changed
+        """
+        if self.__shared:
+            self.__props = dict(self.__props)
+            self.__values = dict(self.__values)
+            self.__shared = False
+        self.__props[sys.intern(prop)] = sys.intern(value)
+        if self.__values:
+            self.__values.pop(prop, None)
+
+    def share_props(self, props, values):
+        """
+            Use props and decoded values dicts shared with other nodes, props must be equal to props of node in the
+            same order, props must be changed by addprop only then, see NodeStore
+        """
+        self.__props = props
+        self.__values = values
+        self.__shared = True
+
+    def value(self, prop):
+        """
+            Return decoded value of prop, it is decoded once and cached:
+                prop;                   True
+                prop = <0x1 0x2>;       (1, 2), several <> are joined, &label is kept as str
+                prop = "a", "b";        ('a', 'b')
+                prop = [01 02];         b'\\x01\\x02'
+                prop = "a", <0x1>;      ('a', (1,)), mixed types are decoded part by part
+            Raise KeyError if node has no prop
+        """
+        return self.__decoded(prop)[1]
+
+    def cells(self, prop):
+        """
+            Return tuple of int if prop is <...> cells, else ()
+        """
+        if not prop in self.__props:
+            return ()
+        kind, value = self.__decoded(prop)
+        return value if kind is int else ()
+
+    def strings(self, prop):
+        """
+            Return tuple of str if prop is "..." strings, else ()
+        """
+        if not prop in self.__props:
+            return ()
+        kind, value = self.__decoded(prop)
+        return value if kind is str else ()
+
+    def __decoded(self, prop):
+        """
+            Return (kind, value), kind is int, str, bytes, bool or None for mixed value
+        """
+        if self.__values is None:
+            self.__values = dict()
+        elif prop in self.__values:
+            return self.__values[prop]
+        decoded = self.__decode(self.__props[prop])
+        self.__values[prop] = decoded
+        return decoded
+
+    def __decode(self, text):
+        if not text:
+            return (bool, True)
+        parts = []
+        kinds = set()
+        for match in DTS_VALUE_PATTERN.finditer(text):
+            if match.lastindex == 1:
+                kinds.add(str)
+                parts.append(DTS_STRING_ESCAPE_PATTERN.sub(self.__unescape, match.group(1)))
+            elif match.lastindex == 2:
+                cells = tuple([self.__decode_cell(cell) for cell in match.group(2).split()])
+                kinds.add(int if all([type(cell) is int for cell in cells]) else None)
+                parts.append(cells)
+            else:
+                kinds.add(bytes)
+                parts.append(bytes.fromhex(match.group(3)))
+        if kinds and kinds <= {int, None}:
+            return (int if kinds == {int} else None, tuple([cell for cells in parts for cell in cells]))
+        if kinds == {str}:
+            return (str, tuple(parts))
+        if kinds == {bytes} and len(parts) == 1:
+            return (bytes, parts[0])
+        return (None, tuple(parts))
+
+    def __decode_cell(self, cell):
+        try:
+            return int(cell, 0)
+        except ValueError:
+            return cell  # &label or expression
+
+    def __unescape(self, match):
+        escape = match.group(1)
+        if escape[0] == 'x':
+            return chr(int(escape[1:], 16))
+        if escape[0].isdigit():
+            return chr(int(escape, 8))
+        return DTS_STRING_ESCAPES.get(escape, escape)
 
     @property
     def name(self):
@@ -86,10 +292,7 @@ class Node():
 
     @property
     def props(self):
-        if self.__propschanged:
-            self.__propsmap = dict(self.__propslist)
-            self.__propschanged = 0
-        return self.__propsmap
+        return self.__props
 
     def dump(self, deepth=0, withdisabled = False):
         """
@@ -102,54 +305,751 @@ class Node():
             return ''.join(result)
         indent_string = '\t' * deepth
         result.append(''.join([indent_string, self.name, ' {\n']))
-        for prop, value in self.__propslist:
+        for prop, value in self.__props.items():
             if value:
                 result.append(''.join([indent_string, '\t', prop, ' = ', value, ';\n']))
             else:
                 result.append(''.join([indent_string, '\t', prop, ';\n']))
-        for node in self.__subnodes:
-            result.append('\n')
-            result.append(node.dump(deepth + 1, withdisabled=withdisabled))
+        for node in self.subnodes:
+            subnode = node.dump(deepth + 1, withdisabled=withdisabled)
+            if subnode:
+                result.append('\n')
+                result.append(subnode)
         result.append(''.join([indent_string, '};\n']))
         return ''.join(result)
 
     def isDisabled(self):
-        if 'status' in self.props.keys() and self.props['status'] == '"disabled"':
-            return True
-        return False
+        return self.__props.get('status') == '"disabled"'
+
+
+def iter_nodes(root, prune=None):
+    """
+        Generator of root and its subnodes in tree order, parent node before its subnodes,
+        node and its subnodes are skipped if prune(node) is True. No recursion, so deep trees
+        are fine, and callers can stop at first match.
+    """
+    if prune and prune(root):
+        return
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        if prune:
+            stack.extend([subnode for subnode in reversed(node.subnodes) if not prune(subnode)])
+        else:
+            stack.extend(reversed(node.subnodes))
+
+
+def node_path(node):
+    """
+        return full path of node, such as /soc/i2c@78b7000
+    """
+    names = []
+    while node.parent:
+        names.append(node.name)
+        node = node.parent
+    return '/' + '/'.join(reversed(names))
+
+
+def phandle_number(text):
+    """
+        return int of phandle text matched as 0x45 or 69, decimal with leading zeros is read as decimal
+    """
+    return int(text, 16) if text[:2] in ('0x', b'0x') else int(text, 10)
+
+
+def iter_props(root, prune=None):
+    """
+        Generator of (node, prop, value) of root and its subnodes in tree order, see iter_nodes
+    """
+    for node in iter_nodes(root, prune):
+        for prop, value in node.props.items():
+            yield (node, prop, value)
+
+
+class LazyNode(Node):
+    """
+        Node of LazyDts, its props and subnodes are parsed by load(node) when any of them is first used
+    """
+    __slots__ = ('__load',)
+
+    def __init__(self, load=None):
+        super().__init__()
+        self.__load = load
+
+    def __loaded(self):
+        if self.__load:
+            load, self.__load = self.__load, None
+            load(self)
+
+    def addprop(self, prop, value):
+        self.__loaded()
+        super().addprop(prop, value)
+
+    def value(self, prop):
+        self.__loaded()
+        return super().value(prop)
+
+    def cells(self, prop):
+        self.__loaded()
+        return super().cells(prop)
+
+    def strings(self, prop):
+        self.__loaded()
+        return super().strings(prop)
+
+    def addsubnode(self, node):
+        self.__loaded()
+        super().addsubnode(node)
+
+    @property
+    def subnodes(self):
+        self.__loaded()
+        return super().subnodes
+
+    @property
+    def props(self):
+        self.__loaded()
+        return super().props
+
+    def dump(self, deepth=0, withdisabled = False):
+        self.__loaded()
+        return super().dump(deepth, withdisabled)
+
+    def isDisabled(self):
+        self.__loaded()
+        return super().isDisabled()
+
+
+class ParseCache():
+    """
+        On-disk cache of parsed Dts trees and indexes, keyed by hash of input file contents,
+        parser version and parse options. Least recently used entries are removed when the
+        cache grows over max_size bytes. Entries are pickled, so directory is created private
+        and it is not used if it is owned by another user or writable by others.
+    """
+    FORMAT = 5  # increased when cached Node or index layout changes
+
+    def __init__(self, directory=None, max_size=256 * 1024 * 1024):
+        if not directory:
+            directory = os.environ.get('DTSPARSER_CACHE_DIR') or \
+                os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'dtsparser')
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, filename, *options):
+        digest = hashlib.sha256()
+        digest.update(repr((__version__, self.FORMAT, options)).encode())
+        with open(filename, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.directory, key + '.cache')
+
+    def load(self, key):
+        """
+            return cached object, None if it is not cached or cache entry is broken
+        """
+        path = self.__path(key)
+        if not self.__private():
+            return None
+        try:
+            with open(path, 'rb') as fd:
+                obj = pickle.loads(zlib.decompress(fd.read()))
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self.__remove(path)
+            return None
+        return obj
+
+    def store(self, key, obj):
+        """
+            Return True if obj is cached, False if directory can not be used or obj can not be written,
+            such as disk is full or obj is too deep to pickle
+        """
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        except OSError:
+            return False
+        if not self.__private():
+            return False
+        try:
+            fd, tmpfile = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, 'wb') as tfd:
+                tfd.write(zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), 1))
+            os.replace(tmpfile, self.__path(key))
+        except (OSError, RecursionError, pickle.PicklingError):
+            self.__remove(tmpfile)
+            return False
+        except BaseException:
+            self.__remove(tmpfile)
+            raise
+        try:
+            self.evict()
+        except OSError:
+            pass
+        return True
+
+    def __private(self):
+        """
+            return True if directory exists, is owned by current user and is not writable by others
+        """
+        try:
+            stat = os.stat(self.directory)
+        except OSError:
+            return False
+        return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+    def evict(self):
+        """
+            remove least recently used entries until cache size is not more than max_size
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.cache'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum([entry[1] for entry in entries])
+        for mtime, filesize, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            self.__remove(path)
+            size -= filesize
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.cache'):
+                    self.__remove(entry.path)
+
+    def __remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class Stats():
+    """
+        Wall time, call count and visited node and property count of each phase,
+        phases may nest, Such as dump_gpio_interrupt_pinctrl_usage runs get_gpio_interrupt_pinctrl_usage
+    """
+    def __init__(self):
+        self.phases = dict()  # {phase: {'seconds': 0.0, 'calls': 0, 'nodes': 0, 'props': 0}} in order of first run
+
+    def __record(self, name):
+        if not name in self.phases:
+            self.phases[name] = {'seconds': 0.0, 'calls': 0, 'nodes': 0, 'props': 0}
+        return self.phases[name]
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+            with stats.phase('parse'): ... adds wall time of the block and one call to phase name
+        """
+        record = self.__record(name)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] += time.perf_counter() - start
+            record['calls'] += 1
+
+    def visit(self, name, nodes=0, props=0):
+        record = self.__record(name)
+        record['nodes'] += nodes
+        record['props'] += props
+
+    def seconds(self, name):
+        return self.phases[name]['seconds'] if name in self.phases else 0.0
+
+    def merge(self, other):
+        for name, other_record in other.phases.items():
+            record = self.__record(name)
+            for field in record:
+                record[field] += other_record[field]
+
+    def report(self):
+        """
+            return breakdown of phases as text table
+        """
+        width = max([len(name) for name in self.phases] + [5])
+        lines = ['{:<{}} {:>10} {:>8} {:>10} {:>10}\n'.format('phase', width, 'seconds', 'calls', 'nodes', 'props')]
+        for name, record in self.phases.items():
+            lines.append('{:<{}} {:>10.4f} {:>8} {:>10} {:>10}\n'.format(
+                name, width, record['seconds'], record['calls'], record['nodes'], record['props']))
+        return ''.join(lines)
+
+
+class Selector():
+    """
+        Compiled node selector, Dts.select(selector) returns nodes matching it, such as
+            soc/*[compatible~="qcom,.*i2c"][status!="disabled"] @pinctrl-0
+
+        path     steps separated by '/' from root, leading '/' is optional, a step is a node name
+                 with glob '*' and '?', '**' is any number of nodes
+        filters  apply to last step, each of them must hold:
+                     [prop] [!prop]        prop exists, doesn't exist
+                     [prop="str"]          one string of prop equals str, != is the opposite
+                     [prop=<0x1 0x2>]      cells of prop equal, != is the opposite
+                     [prop=raw]            prop value is written as raw, such as [prop=<0x1>, <0x2>]
+                     [prop~="regex"]       one string of prop, or prop value if it has no strings, matches regex
+        @prop    optional, select nodes referenced by phandles of prop of matched nodes instead
+
+        Raise ValueError if selector is malformed
+    """
+    def __init__(self, text):
+        self.text = text
+        match = SELECTOR_REFERENCE_PATTERN.fullmatch(text)
+        path, self.reference = match.group(1).strip(), match.group(2)
+        steps = []
+        self.filters = []  # [(prop, op, value), ...], op is 'exists', 'missing', '=', '!=' or '~='
+        pos = 1 if path.startswith('/') else 0
+        while pos < len(path):
+            step = SELECTOR_STEP_PATTERN.match(path, pos)
+            if not step.group(0):
+                raise ValueError('bad selector {}, empty step at {}'.format(text, pos))
+            if self.filters:
+                raise ValueError('bad selector {}, filters must be at end of last step'.format(text))
+            steps.append(step.group(0))
+            pos = step.end()
+            for match in SELECTOR_FILTER_PATTERN.finditer(path, pos):
+                if match.start() != pos:
+                    break
+                self.filters.append(self.__filter(match))
+                pos = match.end()
+            if path.startswith('/', pos) and pos + 1 < len(path):
+                pos += 1
+            elif pos < len(path):
+                raise ValueError('bad selector {} at {}'.format(text, pos))
+        self.prefix = '/'  # path of literal leading steps
+        self.depth = len(steps)  # depth of matched nodes below prefix, None if steps have '**'
+        pattern = []
+        literal = True
+        for step in steps:
+            if step == '**':
+                pattern.append('(?:/[^/]+)*')
+                self.depth = None
+            else:
+                glob = re.escape(step).replace('\\*', '[^/]*').replace('\\?', '[^/]')
+                pattern.append('/' + (glob if step.strip('*') else '[^/]+'))  # names are not empty
+            literal = literal and not [c for c in step if c in '*?']
+            if literal:
+                self.prefix = self.prefix.rstrip('/') + '/' + step
+                self.depth -= 1
+        self.pathpattern = re.compile(''.join(pattern) or '/')
+
+    def __filter(self, match):
+        negate, prop, op, value = match.groups()
+        if not op:
+            return (prop, 'missing' if negate else 'exists', None)
+        if negate:
+            raise ValueError('bad selector {}, ! is only for [!prop]'.format(self.text))
+        if value.startswith('"'):
+            value = value[1:-1].replace('\\"', '"')
+            if op != '~=':
+                value = ('"', value.replace('\\\\', '\\'))
+        elif value.startswith('<') and op != '~=':
+            try:
+                value = ('<', tuple([int(cell, 0) for cell in value[1:-1].split()]))
+            except ValueError:
+                raise ValueError('bad cells in selector {}'.format(self.text))
+        if op == '~=':
+            try:
+                value = re.compile(value)
+            except re.error as e:
+                raise ValueError('bad regular expression in selector {}, {}'.format(self.text, e))
+        return (prop, op, value)
+
+    def matches(self, node):
+        """
+            return True if props of node pass all filters
+        """
+        props = node.props
+        for prop, op, value in self.filters:
+            if op == 'exists' or op == 'missing':
+                if (prop in props) != (op == 'exists'):
+                    return False
+            elif op == '~=':
+                if not prop in props:
+                    return False
+                strings = node.strings(prop)
+                if not [string for string in strings or (props[prop],) if value.search(string)]:
+                    return False
+            else:
+                if not prop in props:
+                    equal = False
+                elif isinstance(value, str):
+                    equal = props[prop] == value
+                elif value[0] == '"':
+                    equal = value[1] in node.strings(prop)
+                else:
+                    equal = node.cells(prop) == value[1]
+                if equal != (op == '='):
+                    return False
+        return True
+
+
+class NodeStore():
+    """
+        Properties shared by nodes of several Dts trees, such as board variants of one SoC.
+        Nodes with equal properties use one props dict and one cache of decoded values,
+        a node copies them before it changes its props, so memory grows with differences of trees.
+        Nodes themselves are not shared, they have parent of their own tree
+    """
+    def __init__(self):
+        self.__entries = dict()  # {hash of props items: [(props, values), ...]}
+        self.props = 0  # number of distinct props dicts
+        self.nodes = 0  # number of nodes sharing them
+
+    def share(self, root):
+        """
+            Share props of root and its subnodes with equal props already in store, props not in store are added
+            Return number of nodes which reused props in store
+        """
+        hits = 0
+        for node in iter_nodes(root):
+            props = node.props
+            items = tuple(props.items())
+            entries = self.__entries.setdefault(hash(items), [])
+            for entry in entries:
+                if entry[0] == props and tuple(entry[0].items()) == items:
+                    hits += 1
+                    break
+            else:
+                entry = (dict([(sys.intern(prop), sys.intern(value)) for prop, value in items]), dict())
+                entries.append(entry)
+                self.props += 1
+            node.share_props(*entry)
+            self.nodes += 1
+        return hits
 
 
 class Dts():
-    def __init__(self, filename, with_disabled_node=False):
+    def __init__(self, filename, with_disabled_node=False, cache=None, stats=None, store=None):
+        """
+            filename is path of dts or dtb file, or dts text as a text stream or an iterable of lines,
+            which is parsed while it is read, Such as stdout of dtc, TypeError is raised if it gives bytes
+            the whole tree is parsed, disabled nodes and their subnodes are left out of queries unless
+            with_disabled_node is True, see view for the other view of the same tree
+            since 2.0.0 Node.subnodes has disabled nodes in both views, use subnodes(node) or is_disabled
+            to walk the tree as queries do
+            cache is a ParseCache, parsed tree is loaded from and saved to it if set and filename is a path
+            store is a NodeStore, node props are shared with other Dts trees in it if set
+            stats is a Stats to record phases in, a new one is used if not set, see stats property
+        """
+        with_disabled_node = bool(with_disabled_node)
+        self.__stats = stats if stats is not None else Stats()
+        key = None
+        state = None
+        ispath = isinstance(filename, (str, bytes, os.PathLike))
+        if cache and ispath:
+            with self.__stats.phase('cache'):
+                key = cache.key(filename)
+                state = cache.load(key)
+        if state:
+            self.__rootnode, self.__disabled, indexes = state
+        else:
+            indexes = dict()  # {with_disabled_node: (phandles, propindex, nodeorder, propnames)}
+            with self.__stats.phase('parse'):
+                if not ispath:
+                    self.__rootnode = self.__node_parser(self.__text_chunks(filename))
+                elif self.__is_dtb(filename):
+                    self.__rootnode = self.__dtb_parser(filename)
+                else:
+                    self.__rootnode = self.__dts_parser(filename)
+            with self.__stats.phase('index'):
+                self.__disabled = self.__disabled_nodes()
+        self.__views = {with_disabled_node: self}  # {with_disabled_node: Dts}, views of the parsed tree
+        self.__init_view(with_disabled_node, indexes.get(with_disabled_node))
+        if key and not with_disabled_node in indexes:
+            indexes[with_disabled_node] = (self.__phandles, self.__propindex, self.__nodeorder, self.__propnames)
+            with self.__stats.phase('cache'):
+                cache.store(key, (self.__rootnode, self.__disabled, indexes))
+        self.__stats.visit('cache' if state else 'parse', len(self.__nodeorder), self.__propcount)
+        if store is not None:
+            with self.__stats.phase('share'):
+                store.share(self.__rootnode)
+            self.__stats.visit('share', len(self.__nodeorder), self.__propcount)
+
+    def __init_view(self, with_disabled_node, indexes=None):
+        """
+            set up queries of the parsed tree with or without disabled nodes, indexes are built if they are not given
+        """
         self.__with_disabled_node = with_disabled_node
-        self.__rootnode = self.__dts_parser(filename)
+        self.__prune = None if with_disabled_node else self.__disabled.__contains__  # prune of iter_nodes
+        if indexes:
+            self.__phandles, self.__propindex, self.__nodeorder, self.__propnames = indexes
+            self.__propcount = sum([len(nodes) for nodes in self.__propindex.values()])
+        else:
+            with self.__stats.phase('index'):
+                self.__build_propindex()
+            self.__propcount = sum([len(nodes) for nodes in self.__propindex.values()])
+            self.__stats.visit('index', len(self.__nodeorder), self.__propcount)
         self.__platform = self.get_platform()
+        self.__hashes = None  # {node: hash}, built by diff
+        self.__paths = None  # {node: path}, built with __pathindex and __labels when they are first used
+        self.__unitaddresses = None  # [(unit address, tree order, node), ...] sorted, built when it is first used
+
+    def view(self, with_disabled_node):
+        """
+            Return Dts of the same parsed tree with disabled nodes and their subnodes, or without them, Such as
+                dts.view(True).get_gpiocontroller_node_phandle()
+            nodes and stats are shared, indexes of a view are built when it is first requested
+        """
+        with_disabled_node = bool(with_disabled_node)
+        if not with_disabled_node in self.__views:
+            view = Dts.__new__(Dts)
+            view.__stats = self.__stats
+            view.__rootnode = self.__rootnode
+            view.__disabled = self.__disabled
+            view.__views = self.__views
+            self.__views[with_disabled_node] = view
+            view.__init_view(with_disabled_node)
+        return self.__views[with_disabled_node]
+
+    def is_disabled(self, node):
+        """
+            Return True if node or one of its ancestors has status = "disabled", it is looked up in a set
+        """
+        return node in self.__disabled
+
+    def __disabled_nodes(self):
+        """
+            return set of disabled nodes and their subnodes
+        """
+        disabled = set()
+        for node in iter_nodes(self.__rootnode):
+            if node.parent in disabled or node.isDisabled():
+                disabled.add(node)
+        return disabled
+
+    def __pruned(self, prune=None):
+        """
+            return prune of iter_nodes which skips nodes out of the view and nodes prune is True for
+        """
+        if self.__prune is None or prune is None:
+            return prune or self.__prune
+        return lambda node: self.__prune(node) or prune(node)
+
+    def subnodes(self, node):
+        """
+            Return subnodes of node in the view, node.subnodes also has disabled nodes out of the enabled view
+        """
+        if self.__prune is None:
+            return node.subnodes
+        return [subnode for subnode in node.subnodes if not subnode in self.__disabled]
+
+    @property
+    def stats(self):
+        return self.__stats
 
     def dump(self):
-        return self.__rootnode.dump(withdisabled=True)
+        return self.__rootnode.dump(withdisabled=self.__with_disabled_node)
 
-    def find_node_by_patternname(self, pattern):
+    def iter_nodes(self, prune=None):
+        """
+            Generator of all nodes of the view in tree order, see iter_nodes
+        """
+        return iter_nodes(self.__rootnode, self.__pruned(prune))
+
+    def iter_props(self, prune=None):
+        """
+            Generator of (node, prop, value) of all nodes of the view in tree order, see iter_props
+        """
+        return iter_props(self.__rootnode, self.__pruned(prune))
+
+    def find_node_by_patternname(self, pattern, subtree=None, unit_address=None):
+        """
+            return list of subnode which name fully matches pattern in tree order
+            subtree is a node or path, only it and its subnodes are searched if it is set
+            unit_address is a prefix of unit address, as 78b for i2c@78b7000, only nodes whose
+            unit address starts with it are searched if it is set, they are looked up in a sorted index
+        """
+        if isinstance(subtree, str):
+            subtree = self.node(subtree)
+            if not subtree:
+                return []
+        elif subtree and not subtree in self.__nodeorder:
+            return []  # out of the view
+        if unit_address is None:
+            return self.find_subnode_by_patternname_recursive(subtree or self.__rootnode, pattern)
+        if self.__unitaddresses is None:
+            self.__unitaddresses = sorted([(node.name.partition('@')[2].lower(), order, node)
+                                           for node, order in self.__nodeorder.items() if '@' in node.name])
+        prefix = unit_address.lower()
+        pattern = re.compile(pattern)
+        subtree_path = self.path(subtree) if subtree else '/'
+        ret = []
+        for address, order, node in self.__unitaddresses[bisect.bisect_left(self.__unitaddresses, (prefix,)):]:
+            if not address.startswith(prefix):
+                break
+            if pattern.fullmatch(node.name):
+                path = self.path(node)
+                if subtree_path == '/' or path == subtree_path or path.startswith(subtree_path + '/'):
+                    ret.append(node)
+        return sorted(ret, key=self.__nodeorder.get)
+
+    def node(self, path):
+        """
+            return node of full path, such as /soc/i2c@78b7000, None if it is not found
+            path may start with an alias or label instead of /, such as i2c1/sensor@38
+        """
+        self.__build_pathindex()
+        if not path.startswith('/'):
+            name, slash, rest = path.partition('/')
+            node = self.label(name)
+            if not node:
+                return None
+            path = self.__paths[node].rstrip('/') + slash + rest
+        if len(path) > 1:
+            path = path.rstrip('/')
+        return self.__pathindex.get(path)
+
+    def label(self, name):
+        """
+            return node of label or alias name, labels are from __symbols__ node and aliases from aliases node,
+            None if it is not found
+        """
+        self.__build_pathindex()
+        return self.__labels.get(name)
+
+    def path(self, node):
         """
-            return list of subnode which name fully matches pattern
+            return full path of node in this tree
         """
-        return self.find_subnode_by_patternname_recursive(self.__rootnode, pattern)
+        self.__build_pathindex()
+        return self.__paths[node]
+
+    def select(self, selector):
+        """
+            Return nodes matching selector in tree order, selector is a str or Selector, see Selector
+            candidates are taken from the smallest index that fits, path and filters are checked in one pass:
+                exact path              path index
+                [phandle=<0x45>]        phandle index
+                [prop], [prop=..]       nodes having prop in property index
+                otherwise               nodes under literal leading steps of path, to the depth of path
+        """
+        if not isinstance(selector, Selector):
+            selector = Selector(selector)
+        with self.__stats.phase('select'):
+            self.__build_pathindex()
+            candidates = self.__select_candidates(selector)
+            paths = self.__paths
+            pathpattern = selector.pathpattern
+            ret = [node for node in candidates if pathpattern.fullmatch(paths[node]) and selector.matches(node)]
+            if selector.reference:
+                match = DTS_REFERENCE_PATTERN.fullmatch(selector.reference)
+                cells_prop = DTS_REFERENCE_PROPS[match.lastindex - 1][1] if match else None
+                targets = dict()
+                for node in ret:
+                    for target, args in self.__references(node.cells(selector.reference), cells_prop) or []:
+                        targets[target] = True
+                ret = list(targets)
+        self.__stats.visit('select', len(candidates))
+        return ret
+
+    def __select_candidates(self, selector):
+        """
+            return nodes in tree order, which include all nodes matching path and filters of selector
+        """
+        if selector.depth == 0 and not selector.prefix in self.__pathindex:
+            return []
+        if selector.depth == 0:
+            return [self.__pathindex[selector.prefix]]
+        candidates = None
+        for prop, op, value in selector.filters:
+            if prop in ('phandle', 'linux,phandle') and op == '=' and isinstance(value, tuple) \
+                    and value[0] == '<' and len(value[1]) == 1:
+                node = self.__phandles.get(value[1][0])
+                return [node] if node else []
+            if op in ('exists', '=', '~='):
+                nodes = self.__propindex.get(prop, [])
+                if candidates is None or len(nodes) < len(candidates):
+                    candidates = nodes
+        if candidates is not None:
+            return candidates
+        root = self.__pathindex.get(selector.prefix)
+        if not root:
+            return []
+        if selector.depth is None:
+            return list(iter_nodes(root, self.__prune))
+        depth = self.__paths[root].count('/') if root.parent else 0
+        maxdepth = depth + selector.depth
+        return [node for node in iter_nodes(root, self.__pruned(lambda node: self.__paths[node].count('/') > maxdepth))
+                if self.__paths[node].count('/') == maxdepth]
+
+    def __build_pathindex(self):
+        """
+            build {node: path}, {path: node} and {label: node} once
+        """
+        if self.__paths is not None:
+            return
+        self.__paths = dict()
+        for node in self.__nodeorder:
+            parent = node.parent
+            if parent is None:
+                self.__paths[node] = '/'
+            else:
+                self.__paths[node] = (self.__paths[parent] if parent.parent else '') + '/' + node.name
+        self.__pathindex = dict([(path, node) for node, path in self.__paths.items()])
+        self.__labels = dict()
+        for name in ('aliases', '__symbols__'):
+            node = self.__pathindex.get('/' + name)
+            if not node:
+                continue
+            for label in node.props:
+                target = node.strings(label)
+                if len(target) == 1 and target[0] in self.__pathindex:
+                    self.__labels[label] = self.__pathindex[target[0]]
 
     def get_platform(self):
-        compatible_value = self.__rootnode.props['compatible']
-        if re.search(re.compile('(sprd)|(Spreadtrum)', re.IGNORECASE), compatible_value):
-            return Platform.SPRD
-        elif re.search(re.compile('(mediatek)|(mtk)',re.IGNORECASE), compatible_value):
-            return Platform.MTK
-        elif re.search(re.compile('qcom', re.IGNORECASE), compatible_value):
-            return Platform.QUALCOMM
+        return Platform.from_compatible(self.__rootnode.props.get('compatible', ''))
 
     def find_node_by_phandle(self, phandle):
-        node_statement = self.find_node_statement_by_statementpattern('phandle = <{}>'.format(phandle))
-        if node_statement:
-            return list(node_statement.keys())[0]
-        else:
-            print('node with phandle = <{}> is not found, please check'.format(phandle))
+        """
+            phandle is a str as 0x45 or <0x45>, or an int, lookup is done in phandle index
+        """
+        node = self.__phandles.get(self.__phandle_key(phandle))
+        if node:
+            return node
+        print('node with phandle = <{}> is not found, please check'.format(phandle))
+        return None
+
+    def __phandle_key(self, phandle):
+        """
+            return int key of phandle index, phandle is as 0x45, <0x45> or 69
+        """
+        if isinstance(phandle, int):
+            return phandle
+        try:
+            return int(phandle.strip('<> '), 0)
+        except ValueError:
+            pass
+        value = re.search(re.compile('0x[0-9a-fA-F]+|[0-9]+'), phandle)
+        if not value:
             return None
+        return phandle_number(value.group(0))
+
+    def __index_phandle(self, node):
+        """
+            add node to phandle index, both phandle and linux,phandle are indexed
+        """
+        for prop in ('phandle', 'linux,phandle'):
+            if prop in node.props.keys():
+                phandle = self.__phandle_key(node.props[prop])
+                if phandle is not None:
+                    self.__phandles.setdefault(phandle, node)
 
     def find_node_ancestor_with_compatible_prop(self, node):
         """
@@ -171,7 +1071,83 @@ class Dts():
             Return: {node: {prop1:value1, prop2:value2}, ....]
             statement is prop = "value" or prop;
         """
-        return self.find_node_statement_by_statementpattern_recursive(self.__rootnode, pattern)
+        ret = dict()
+        with self.__stats.phase('find_node_statement_by_statementpattern'):
+            prefix = self.__pattern_prefix(pattern)
+            candidates = self.__propindex_candidates(prefix)
+            for node in candidates:
+                self.__match_node_statement(node, pattern, prefix, ret)
+        self.__stats.visit('find_node_statement_by_statementpattern', len(candidates))
+        return ret
+
+    def __build_propindex(self):
+        """
+            build {prop: [node1, node2, ...]} and phandle index of nodes in the view once, nodes are in tree order
+        """
+        self.__propindex = dict()
+        self.__nodeorder = dict()
+        self.__phandles = dict()  # {0x45: node}
+        for node in iter_nodes(self.__rootnode, self.__prune):
+            self.__nodeorder[node] = len(self.__nodeorder)
+            self.__index_phandle(node)
+            for prop in node.props:
+                if prop in self.__propindex:
+                    self.__propindex[prop].append(node)
+                else:
+                    self.__propindex[prop] = [node]
+        self.__propnames = sorted(self.__propindex.keys())
+
+    def __propindex_candidates(self, prefix):
+        """
+            return nodes in tree order which have a property whose statement may start with prefix
+        """
+        if not prefix:
+            return list(self.__nodeorder.keys())
+        name = re.match('[^ =]*', prefix).group()
+        if name != prefix:
+            return self.__propindex.get(name, [])
+        names = []
+        for name in self.__propnames[bisect.bisect_left(self.__propnames, prefix):]:
+            if not name.startswith(prefix):
+                break
+            names.append(name)
+        if len(names) == 1:
+            return self.__propindex[names[0]]
+        nodes = set()
+        for name in names:
+            nodes.update(self.__propindex[name])
+        return sorted(nodes, key=self.__nodeorder.get)
+
+    def __pattern_prefix(self, pattern):
+        """
+            return literal string that every statement matching pattern starts with, maybe ''
+        """
+        if isinstance(pattern, re.Pattern):
+            if pattern.flags & (re.IGNORECASE | re.VERBOSE):
+                return ''
+            pattern = pattern.pattern
+        if '|' in pattern:
+            return ''
+        prefix = []
+        for c in pattern:
+            if c in '.^$*+?{}[]\\()':
+                if c in '*?{' and prefix:
+                    prefix.pop()
+                break
+            prefix.append(c)
+        return ''.join(prefix)
+
+    def __match_node_statement(self, node, pattern, prefix, ret):
+        """
+            add {prop: value} of node statements fully matching pattern into ret[node]
+        """
+        for prop, value in node.props.items():
+            statement = prop + ' = ' + value if value else prop
+            if statement.startswith(prefix) and re.fullmatch(pattern, statement):
+                if node in ret.keys():
+                    ret[node][prop] = value
+                else:
+                    ret[node] = {prop: value}
 
     def get_interrup_controller_node_phandle(self):
         """
@@ -181,10 +1157,8 @@ class Dts():
         ret = dict()
         nodes_statement = self.find_node_statement_by_statementpattern('interrupt-controller')
         for node in nodes_statement:
-            if 'phandle' in node.props:
-                phandle = node.props['phandle']
-                phandle = phandle[phandle.index('<')+1:phandle.index('>')]
-                ret[node] = phandle
+            if node.cells('phandle'):
+                ret[node] = '{:#x}'.format(node.cells('phandle')[0])
         return ret
 
     def get_gpiocontroller_node_phandle(self):
@@ -195,22 +1169,22 @@ class Dts():
         ret = dict()
         nodes_statement = self.find_node_statement_by_statementpattern('gpio-controller')
         for node in nodes_statement:
-            if 'phandle' in node.props:
-                phandle = node.props['phandle']
-                phandle = phandle[phandle.index('<')+1:phandle.index('>')]
-                ret[node] = phandle
+            if node.cells('phandle'):
+                ret[node] = '{:#x}'.format(node.cells('phandle')[0])
         return ret
 
     def get_pinctrlnode(self):
-        usedpinctrlhandle_nodeinfo = self.get_used_pinctrl_phandle_node()
         pinctrlnodes = []
-        for handle in usedpinctrlhandle_nodeinfo:
-            node = self.find_node_by_phandle(handle)
-            if not node:
-                continue
-            node = self.find_node_ancestor_with_compatible_prop(node)
-            if not node in pinctrlnodes:
-                pinctrlnodes.append(node)
+        with self.__stats.phase('get_pinctrlnode'):
+            usedpinctrlhandle_nodeinfo = self.get_used_pinctrl_phandle_node()
+            for handle in usedpinctrlhandle_nodeinfo:
+                node = self.find_node_by_phandle(handle)
+                if not node:
+                    continue
+                node = self.find_node_ancestor_with_compatible_prop(node)
+                if not node in pinctrlnodes:
+                    pinctrlnodes.append(node)
+        self.__stats.visit('get_pinctrlnode', len(usedpinctrlhandle_nodeinfo))
         return pinctrlnodes
 
     def get_used_pinctrl_phandle_node(self):
@@ -220,14 +1194,29 @@ class Dts():
             Raise exception ValueError need handler outside
         """
         ret = dict()
-        nodes_statement = self.find_node_statement_by_statementpattern(re.compile('pinctrl-[0-9]+ = <( *0x[0-9a-fA-F]+ *)+>'))
-        for node in nodes_statement:
-            for prop in nodes_statement[node]:
-                for phandle in re.split(re.compile('[<> ]'), nodes_statement[node][prop]):
-                    if phandle:
-                        if not phandle in ret.keys():
-                            ret[phandle] = []
-                        ret[phandle].append(node)
+        nodes_props = self.__find_node_props_by_propname('pinctrl-[0-9]+')
+        for node in nodes_props:
+            for prop in nodes_props[node]:
+                for phandle in node.cells(prop):
+                    phandle = '{:#x}'.format(phandle)
+                    if not phandle in ret.keys():
+                        ret[phandle] = []
+                    ret[phandle].append(node)
+        return ret
+
+    def __find_node_props_by_propname(self, pattern):
+        """
+            Return: {node1: [prop1, prop2], ...} in tree order, prop fully matches pattern
+        """
+        ret = dict()
+        prefix = self.__pattern_prefix(pattern)
+        for node in self.__propindex_candidates(prefix):
+            for prop in node.props:
+                if prop.startswith(prefix) and re.fullmatch(pattern, prop):
+                    if node in ret.keys():
+                        ret[node].append(prop)
+                    else:
+                        ret[node] = [prop]
         return ret
 
     def get_pinctrl_gpio_node_info(self, pinctrlnode):
@@ -237,65 +1226,57 @@ class Dts():
         if not isinstance(pinctrlnode, Node):
             raise ValueError('pinctrlnode must be a node')
         ret = dict()
-        phandles_node = self.get_used_pinctrl_phandle_node()
-        for phandle in phandles_node:
-            node = self.find_node_by_phandle(phandle)
-            if not node:
-                continue
-            node = self.find_node_ancestor_with_compatible_prop(node)
-            if node != pinctrlnode:
-                continue
-            for node_use_pinctrl in phandles_node[phandle]:
+        with self.__stats.phase('get_pinctrl_gpio_node_info'):
+            phandles_node = self.get_used_pinctrl_phandle_node()
+            for phandle in phandles_node:
                 subpinctrlnode = self.find_node_by_phandle(phandle)
                 if not subpinctrlnode:
                     continue
-                if self.__platform == Platform.QUALCOMM:
-                    node_statement = self.find_node_statement_by_statementpattern_recursive(subpinctrlnode, 'pins = .*gpio[0-9].*')
-                    for node in node_statement.keys():
-                        pins = node_statement[node]
-                        for prop in pins.keys():
-                            value = pins[prop]
-                            gpio_property = re.findall(re.compile('[0-9]+'), value)
-                            for value in gpio_property:                        
-                                num = int(value)
-                                if not num in ret.keys():
-                                    ret[num] = []
-                                ret[num].append((node_use_pinctrl, subpinctrlnode))
-                elif self.__platform == Platform.MTK:
-                    node_statement = self.find_node_statement_by_statementpattern_recursive(subpinctrlnode, 'pins\s+=\s+<\s*0x[0-9a-fA-F]+\s*>')
-                    for node in node_statement.keys():
-                        pins = node_statement[node]
-                        for prop in pins.keys():
-                            value = pins[prop]
-                            value = int(value[value.index('<')+1:value.index('>')], 16)
-                            num = (value & 0xFF00) >> 8
-                            if not num in ret.keys():
-                                ret[num] = []
-                            ret[num].append((node_use_pinctrl, subpinctrlnode))
-                elif self.__platform == Platform.SPRD:
-                    node_statement = self.find_node_statement_by_statementpattern_recursive(subpinctrlnode, 'pins = <(\s*0x[0-9a-fA-F]+\s*)+>')
-                    for node in node_statement.keys():
-                        pins = node_statement[node]
-                        for prop in pins.keys():
-                            value = pins[prop]
-                            gpio_property = re.findall(re.compile('0x[0-9a-fA-F]+'), value)
-                            for value in [int(gpio_property[i], 16) for i in range(0, len(gpio_property), 2)]:
-                                num = (value >>20) & 0xFFF
-                                if not num in ret.keys():
-                                    ret[num] = []
-                                ret[num].append((node_use_pinctrl, subpinctrlnode))
-        return ret       
+                if self.find_node_ancestor_with_compatible_prop(subpinctrlnode) != pinctrlnode:
+                    continue
+                nums = self.get_pinctrl_pins(subpinctrlnode)
+                for node_use_pinctrl in phandles_node[phandle]:
+                    for num in nums:
+                        if not num in ret.keys():
+                            ret[num] = []
+                        ret[num].append((node_use_pinctrl, subpinctrlnode))
+        self.__stats.visit('get_pinctrl_gpio_node_info', len(phandles_node))
+        return ret
+
+    def get_pinctrl_pins(self, subpinctrlnode):
+        """
+            return gpio numbers configured by pins property of subpinctrlnode and its subnodes, [gpio1, gpio2, ...]
+                QUALCOMM: pins = "gpio12", "gpio13";
+                MTK: pins = <0xc06>; gpio is (pin & 0xFF00) >> 8
+                SPRD: pins = <pin1 function1 pin2 function2 ...>; gpio is (pin >> 20) & 0xFFF
+        """
+        ret = []
+        for node in iter_nodes(subpinctrlnode, self.__prune):
+            if not 'pins' in node.props:
+                continue
+            if self.__platform == Platform.QUALCOMM:
+                strings = node.strings('pins')
+                if [string for string in strings if re.search(re.compile('gpio[0-9]'), string)]:
+                    for string in strings:
+                        ret.extend([int(num) for num in re.findall(re.compile('[0-9]+'), string)])
+            elif self.__platform == Platform.MTK:
+                ret.extend([(pin & 0xFF00) >> 8 for pin in node.cells('pins')])
+            elif self.__platform == Platform.SPRD:
+                ret.extend([(pin >> 20) & 0xFFF for pin in node.cells('pins')[0::2]])
+        return ret
 
     def gpio_nodename_property_used(self, gpiocontroller_node):
         """
             Return all gpio used of node and its subnode, {gpio1: [(node1, property1), (node2, property2)], gpio2:[ ... ]}
         """
         ret = dict()
-        node_property_gpio_used = self.get_node_property_gpio_use_recursive(self.__rootnode, gpiocontroller_node)
-        for node, prop, gpio in node_property_gpio_used:
-            if not gpio in ret.keys():
-                ret[gpio] = []
-            ret[gpio].append((node, prop))
+        with self.__stats.phase('gpio_nodename_property_used'):
+            node_property_gpio_used = self.get_node_property_gpio_use_recursive(self.__rootnode, gpiocontroller_node)
+            for node, prop, gpio in node_property_gpio_used:
+                if not gpio in ret.keys():
+                    ret[gpio] = []
+                ret[gpio].append((node, prop))
+        self.__stats.visit('gpio_nodename_property_used', len(self.__nodeorder), self.__propcount)
         return ret
 
     def interruptgpio_nodename_used(self, interruptcontroller_node):
@@ -303,48 +1284,149 @@ class Dts():
         Return: {gpio:{nodename1, nodename2, ...}, ...}
         """
         ret = dict()
-        interruptcontroller_phandle = re.search(re.compile('0x[0-9a-fA-F]+'), interruptcontroller_node.props['phandle']).group(0)
-        interrupts_node = self.find_node_statement_by_statementpattern(re.compile('interrupt-parent = <0x[0-9a-fA-F]+>')).keys()
-        for node in interrupts_node:
-            if re.search(re.compile('0x[0-9a-fA-F]+'), node.props['interrupt-parent']).group(0) == interruptcontroller_phandle:
-                if 'interrupts' in node.props.keys():
-                    interrupts_property = re.findall(re.compile('0x[0-9a-fA-F]+'), node.props['interrupts'])
-                    gpios = [int(interrupts_property[i], 16) for i in range(0, len(interrupts_property), 2)]
-                    for gpio in gpios:
+        with self.__stats.phase('interruptgpio_nodename_used'):
+            interruptcontroller_phandle = interruptcontroller_node.cells('phandle')[:1]
+            interrupts_node = self.find_node_statement_by_statementpattern('interrupt-parent = .*').keys()
+            for node in interrupts_node:
+                if node.cells('interrupt-parent') == interruptcontroller_phandle:
+                    for gpio in node.cells('interrupts')[0::2]:
                         if not gpio in ret.keys():
                             ret[gpio] = set()
                         ret[gpio].add(node.name)
+        self.__stats.visit('interruptgpio_nodename_used', len(interrupts_node))
         return ret
 
-    def dump_gpio_interrupt_pinctrl_usage(self):
-        interrupt_nodes_phandle = self.get_interrup_controller_node_phandle()
-        gpiocontroller_nodes_phandle = self.get_gpiocontroller_node_phandle()
-        pinctrlnodes = self.get_pinctrlnode()
+    def get_gpio_interrupt_pinctrl_usage(self):
+        """
+            Analyse gpio, interrupt and pinctrl usage of all controllers in one traversal
+            Return: {controller1: (gpio_nodeinfo, interrupt_nodeinfo, pinctrl_nodeinfo), ...}
+                controllers are gpio, interrupt and pinctrl controllers with compatible prop in tree order
+                gpio_nodeinfo is {gpio: [(node, prop), ...]} as gpio_nodename_property_used
+                interrupt_nodeinfo is {gpio: {nodename, ...}} as interruptgpio_nodename_used
+                pinctrl_nodeinfo is {gpio: [(node, subpinctrlnode), ...]} as get_pinctrl_gpio_node_info
+        """
+        ret = dict()
+        for controller, (gpio_usage, interrupt_usage, pinctrl_usage) in self.__gpio_usage().items():
+            interrupt_nodeinfo = dict()
+            for gpio in interrupt_usage:
+                interrupt_nodeinfo[gpio] = set([node.name for node, prop, config in interrupt_usage[gpio]])
+            pinctrl_nodeinfo = dict()
+            for gpio in pinctrl_usage:
+                pinctrl_nodeinfo[gpio] = [(node, config) for node, prop, config in pinctrl_usage[gpio]]
+            gpio_nodeinfo = dict()
+            for gpio in gpio_usage:
+                gpio_nodeinfo[gpio] = [(node, prop) for node, prop, config in gpio_usage[gpio]]
+            ret[controller] = (gpio_nodeinfo, interrupt_nodeinfo, pinctrl_nodeinfo)
+        return ret
 
-        nodes = set()
-        for node in interrupt_nodes_phandle:
-            nodes.add(node)
-        for node in gpiocontroller_nodes_phandle:
-            nodes.add(node)
-        for node in pinctrlnodes:
-                nodes.add(node)
-        first = True
-        msg_list = []
-        for node in nodes:
-            if 'compatible' in node.props.keys():
-                if node in gpiocontroller_nodes_phandle:
-                    gpio_nodeinfo = self.gpio_nodename_property_used(node)
-                else:
-                    gpio_nodeinfo = dict()
-                if node in gpiocontroller_nodes_phandle:
-                    interrupt_nodeinfo = self.interruptgpio_nodename_used(node)
-                else:
-                    interrupt_nodeinfo = dict()
-                if node in pinctrlnodes:
-                    pictrl_nodeinfo = self.get_pinctrl_gpio_node_info(node)
-                else:
-                    pictrl_nodeinfo = dict()
+    def iter_gpio_usage_records(self):
+        """
+            Generator of gpio usage records of get_gpio_interrupt_pinctrl_usage, one dict per use with keys GPIO_RECORD_FIELDS:
+                controller  path of gpio, interrupt or pinctrl controller
+                gpio        gpio number
+                kind        'gpio', 'interrupt' or 'pinctrl'
+                consumer    path of node using the gpio
+                prop        property of consumer, such as reset-gpios, interrupts or pinctrl-0
+                config      path of pinctrl config node for pinctrl, None otherwise
+            records are sorted by controller in tree order, gpio and kind, consumers are in tree order,
+            the same use is listed once
+        """
+        return self.__gpio_records(conflicts_only=False)
 
+    def iter_gpio_conflict_records(self):
+        """
+            Generator of records of iter_gpio_usage_records of gpios used by more than one node only, such as a gpio
+            in reset-gpios of one node and in pins of pinctrl-0 of another node, uses by one node and its subnodes,
+            such as gpio-keys and its keys, are no conflict
+        """
+        return self.__gpio_records(conflicts_only=True)
+
+    def __gpio_records(self, conflicts_only):
+        usage = self.__gpio_usage()
+        self.__build_pathindex()
+        paths = self.__paths
+        for controller in usage:
+            consumers = dict()  # {gpio: [node, ...]}
+            for kind_usage in usage[controller]:
+                for num, uses in kind_usage.items():
+                    consumers.setdefault(num, []).extend([node for node, prop, config in uses])
+            nums = consumers
+            if conflicts_only:
+                nums = []
+                for num, nodes in consumers.items():
+                    owner = paths[min(nodes, key=lambda node: len(paths[node]))] + '/'
+                    if [node for node in nodes if not (paths[node] + '/').startswith(owner)]:
+                        nums.append(num)
+            for num in sorted(nums):
+                for kind, kind_usage in zip(GPIO_USAGE_KINDS, usage[controller]):
+                    for node, prop, config in dict.fromkeys(kind_usage.get(num, [])):
+                        yield {'controller': paths[controller], 'gpio': num, 'kind': kind, 'consumer': paths[node],
+                               'prop': prop, 'config': paths[config] if config else None}
+
+    def __gpio_usage(self):
+        """
+            Analyse gpio, interrupt and pinctrl usage of all controllers in one traversal
+            Return: {controller1: (gpio_usage, interrupt_usage, pinctrl_usage), ...}, controllers as get_gpio_interrupt_pinctrl_usage
+                each usage is {gpio: [(node, prop, config), ...]} in tree order of node, config is subpinctrlnode
+                for pinctrl_usage, None otherwise
+        """
+        with self.__stats.phase('get_gpio_interrupt_pinctrl_usage'):
+            gpiocontrollers = dict()  # {phandle: gpiocontroller_node}
+            for node, phandle in self.get_gpiocontroller_node_phandle().items():
+                gpiocontrollers.setdefault(int(phandle, 16), node)
+            controllers = set(self.get_interrup_controller_node_phandle())
+            controllers.update(gpiocontrollers.values())
+            usage = dict()
+            for node in controllers:
+                usage[node] = (dict(), dict(), dict())
+            pinctrls = dict()  # {phandle: (subpinctrlnode, pinctrlnode, pins)}
+
+            for node in iter_nodes(self.__rootnode, self.__prune):
+                props = node.props
+                for prop in props:
+                    if prop.startswith('pinctrl-') and prop[8:].isdigit():
+                        for phandle in node.cells(prop):
+                            if not phandle in pinctrls:
+                                subpinctrlnode = self.find_node_by_phandle('{:#x}'.format(phandle))
+                                if subpinctrlnode:
+                                    pinctrlnode = self.find_node_ancestor_with_compatible_prop(subpinctrlnode)
+                                    pinctrls[phandle] = (subpinctrlnode, pinctrlnode, self.get_pinctrl_pins(subpinctrlnode))
+                                    if pinctrlnode and not pinctrlnode in usage:
+                                        usage[pinctrlnode] = (dict(), dict(), dict())
+                                else:
+                                    pinctrls[phandle] = (None, None, [])
+                            subpinctrlnode, pinctrlnode, pins = pinctrls[phandle]
+                            for num in pins:
+                                usage[pinctrlnode][2].setdefault(num, []).append((node, prop, subpinctrlnode))
+                    if props[prop][:1] != '<':
+                        continue
+                    cells = node.cells(prop)
+                    if cells and len(cells) % 3 == 0 and cells[0] in gpiocontrollers \
+                            and cells[0::3].count(cells[0]) == len(cells) // 3:
+                        gpio_nodeinfo = usage[gpiocontrollers[cells[0]]][0]
+                        for gpio in cells[1::3]:
+                            gpio_nodeinfo.setdefault(gpio, []).append((node, prop, None))
+                if 'interrupt-parent' in props:
+                    interrupt_parent = node.cells('interrupt-parent')
+                    if len(interrupt_parent) == 1 and interrupt_parent[0] in gpiocontrollers:
+                        interrupt_nodeinfo = usage[gpiocontrollers[interrupt_parent[0]]][1]
+                        for gpio in node.cells('interrupts')[0::2]:
+                            interrupt_nodeinfo.setdefault(gpio, []).append((node, 'interrupts', None))
+
+            ret = dict()
+            for node in sorted(usage, key=self.__nodeorder.get):
+                if 'compatible' in node.props.keys():
+                    ret[node] = usage[node]
+        self.__stats.visit('get_gpio_interrupt_pinctrl_usage', len(self.__nodeorder), self.__propcount)
+        return ret
+
+    def dump_gpio_interrupt_pinctrl_usage(self):
+        with self.__stats.phase('dump_gpio_interrupt_pinctrl_usage'):
+            first = True
+            msg_list = []
+            controllers_usage = self.get_gpio_interrupt_pinctrl_usage()
+            for node in controllers_usage:
+                gpio_nodeinfo, interrupt_nodeinfo, pictrl_nodeinfo = controllers_usage[node]
                 nums = list(gpio_nodeinfo.keys()) + list(interrupt_nodeinfo.keys()) + list(pictrl_nodeinfo.keys())
                 nums = list(set(nums))
                 nums.sort()
@@ -360,11 +1442,11 @@ class Dts():
                     try:
                         if gpio_nodeinfo[num]:
                             usage = set()
-                            for node, prop in gpio_nodeinfo[num]:
-                                usage.add('\t{} -> {}\n'.format(node.name, prop))
+                            for node1, prop in gpio_nodeinfo[num]:
+                                usage.add('\t{} -> {}\n'.format(node1.name, prop))
                             if usage:
                                 msg_list.append('node:\n')
-                            msg_list += list(usage)
+                            msg_list += sorted(usage)
                     except KeyError:
                         pass
                     try:
@@ -374,7 +1456,7 @@ class Dts():
                                 usage.add('\t{}\n'.format(nodename))
                             if usage:
                                 msg_list.append('interrupt:\n')
-                            msg_list += list(usage)
+                            msg_list += sorted(usage)
                     except KeyError:
                         pass
                     try:
@@ -384,11 +1466,290 @@ class Dts():
                                 usage.add('\t{} -> {}\n'.format(node1.name, node2.name))
                             if usage:
                                 msg_list.append('pinctrl:\n')
-                            msg_list += list(usage)
+                            msg_list += sorted(usage)
                     except KeyError:
                         pass
         return ''.join(msg_list)
 
+    def apply_overlay(self, overlay):
+        """
+            Apply overlay to the tree in memory as fdtoverlay does, overlay is a Dts or path of a compiled overlay,
+            dtbo or dts decompiled from it, whose fragment@N nodes have target = <phandle> or target-path and __overlay__
+                phandles of overlay nodes are renumbered after the largest phandle of the tree, and references
+                to them listed in __local_fixups__ are adjusted
+                references to labels of the tree listed in __fixups__ are resolved by __symbols__ of the tree,
+                a phandle is added to the referenced node if it has none
+                labels in __symbols__ of overlay are added to __symbols__ of the tree
+            overlay is not changed, its nodes are copied. Targets and labels are looked up in the whole tree, so
+            overlays can enable disabled nodes. Views of the tree got before are not updated, get them again by view
+            Raise ValueError if a target or label is not found, or a fixup is malformed, the tree is not changed then
+        """
+        if not isinstance(overlay, Dts):
+            overlay = Dts(overlay, with_disabled_node=True, stats=self.__stats)
+        overlay = overlay.view(True)
+        with self.__stats.phase('apply_overlay'):
+            tree = self.view(True)
+            phandles = dict()  # {node: phandle} to add to referenced nodes of the tree which have none
+            fixups = overlay.__overlay_fixups(tree, phandles)
+            fragments = []  # [(__overlay__ path, __overlay__ node, target), ...]
+            for fragment in overlay.__rootnode.subnodes:
+                subnodes = [subnode for subnode in fragment.subnodes if subnode.name == '__overlay__']
+                if not subnodes:
+                    continue
+                if 'target' in fragment.props:
+                    cells = overlay.__fixed_cells(fragment, 'target', fixups)
+                    target = None
+                    if len(cells) == 1:
+                        target = tree.__phandles.get(cells[0]) or dict([(phandle, node) for node, phandle in
+                                                                        phandles.items()]).get(cells[0])
+                else:
+                    path = fragment.strings('target-path')
+                    target = tree.node(path[0]) if len(path) == 1 else None
+                if not target:
+                    raise ValueError('target of overlay {} is not found'.format(fragment.name))
+                fragments.append(('/{}/__overlay__'.format(fragment.name), subnodes[0], target))
+            # the tree is changed only after every target and fixup is resolved
+            try:
+                for node, phandle in phandles.items():
+                    node.addprop('phandle', '<{:#x}>'.format(phandle))
+                for prefix, overlay_node, target in fragments:
+                    self.__merge_overlay(target, overlay_node, overlay, fixups)
+                overlay_symbols = overlay.node('/__symbols__')
+                if overlay_symbols:
+                    self.__merge_symbols(overlay_symbols, [(prefix, target) for prefix, overlay_node, target in fragments])
+            finally:
+                self.__disabled = self.__disabled_nodes()
+                self.__views = {self.__with_disabled_node: self}
+                self.__init_view(self.__with_disabled_node)
+        self.__stats.visit('apply_overlay', len(self.__nodeorder), self.__propcount)
+
+    def __overlay_fixups(self, base, phandles):
+        """
+            return {(node, prop): {cell index: phandle}} of overlay tree, cells to change when it is applied to Dts base
+            phandles to add to labeled nodes of base which have none are put in phandles {node: phandle}, base is not changed
+        """
+        fixups = dict()
+        delta = max(base.__phandles, default=0)
+        for phandle, node in self.__phandles.items():
+            for prop in ('phandle', 'linux,phandle'):
+                if node.cells(prop) == (phandle,):
+                    fixups.setdefault((node, prop), dict())[0] = phandle + delta
+        local_fixups = self.node('/__local_fixups__')
+        if local_fixups:
+            depth = len(node_path(local_fixups))
+            for fixup in iter_nodes(local_fixups):
+                node = self.node(node_path(fixup)[depth:] or '/')
+                if not node:
+                    raise ValueError('node of local fixup {} is not found'.format(node_path(fixup)))
+                for prop in fixup.props:
+                    cells = node.cells(prop)
+                    for offset in fixup.cells(prop):
+                        if offset % 4 or offset // 4 >= len(cells):
+                            raise ValueError('bad local fixup {} of {}'.format(prop, node_path(fixup)))
+                        fixups.setdefault((node, prop), dict())[offset // 4] = cells[offset // 4] + delta
+        symbol_fixups = self.node('/__fixups__')
+        if symbol_fixups:
+            for label in symbol_fixups.props:
+                target = base.label(label)
+                if not target:
+                    raise ValueError('label {} of overlay is not found'.format(label))
+                phandle = base.__node_phandle(target, phandles, delta + max(self.__phandles, default=0))
+                for reference in symbol_fixups.strings(label):
+                    path, colon, offset = reference.rpartition(':')
+                    path, colon, prop = path.rpartition(':')
+                    node = self.node(path)
+                    if not node or not offset.isdigit() or int(offset) % 4 or int(offset) // 4 >= len(node.cells(prop)):
+                        raise ValueError('bad fixup {} of label {}'.format(reference, label))
+                    fixups.setdefault((node, prop), dict())[int(offset) // 4] = phandle
+        return fixups
+
+    def __fixed_cells(self, node, prop, fixups):
+        """
+            return cells of prop of overlay node, changed by fixups
+        """
+        cells = node.cells(prop)
+        if (node, prop) in fixups:
+            cells = list(cells)
+            for index, phandle in fixups[(node, prop)].items():
+                cells[index] = phandle
+            cells = tuple(cells)
+        return cells
+
+    def __node_phandle(self, node, phandles, last):
+        """
+            return phandle of node, if it has none a new one after last and phandles is put in phandles {node: phandle}
+        """
+        for prop in ('phandle', 'linux,phandle'):
+            cells = node.cells(prop)
+            if len(cells) == 1 and self.__phandles.get(cells[0]) is node:
+                return cells[0]
+        if not node in phandles:
+            phandles[node] = max(phandles.values(), default=last) + 1
+        return phandles[node]
+
+    def __merge_overlay(self, target, overlay_node, overlay, fixups):
+        """
+            add props and subnodes of overlay_node to target node recursively, existing props are replaced
+        """
+        stack = [(target, overlay_node)]
+        while stack:
+            node, overlay_node = stack.pop()
+            for prop, value in overlay_node.props.items():
+                if (overlay_node, prop) in fixups:
+                    value = '<{}>'.format(' '.join(['{:#x}'.format(cell) for cell in
+                                                    overlay.__fixed_cells(overlay_node, prop, fixups)]))
+                node.addprop(prop, value)
+            subnodes = dict([(subnode.name, subnode) for subnode in node.subnodes])
+            pairs = []
+            for overlay_subnode in overlay_node.subnodes:
+                subnode = subnodes.get(overlay_subnode.name)
+                if not subnode:
+                    subnode = Node()
+                    subnode.name = overlay_subnode.name
+                    node.addsubnode(subnode)
+                pairs.append((subnode, overlay_subnode))
+            stack.extend(reversed(pairs))
+
+    def __merge_symbols(self, overlay_symbols, fragments):
+        """
+            add labels of overlay __symbols__ to __symbols__ of the tree, fragments is [(__overlay__ path, target), ...]
+        """
+        symbols = [subnode for subnode in self.__rootnode.subnodes if subnode.name == '__symbols__']
+        if symbols:
+            symbols = symbols[0]
+        else:
+            symbols = Node()
+            symbols.name = '__symbols__'
+            self.__rootnode.addsubnode(symbols)
+        for label in overlay_symbols.props:
+            path = overlay_symbols.strings(label)
+            for prefix, target in fragments:
+                if len(path) == 1 and (path[0] == prefix or path[0].startswith(prefix + '/')):
+                    symbols.addprop(label, '"{}"'.format((node_path(target) + path[0][len(prefix):]).replace('//', '/')))
+                    break
+
+    def diff(self, other):
+        """
+            Compare with Dts other, subtrees with the same hash are skipped, phandle numbers are ignored
+            and properties referencing nodes by phandle are compared by node path, see DTS_REFERENCE_PROPS
+            Return: [(change, path, prop, old, new), ...] in tree order
+                change is 'added', 'removed' or 'changed', path is node path
+                prop is None for added or removed node, old and new are the Node objects then,
+                otherwise they are prop values, old is None for added prop and new is None for removed prop
+        """
+        ret = []
+        with self.__stats.phase('diff'):
+            hashes = self.__tree_hashes()
+            other_hashes = other.__tree_hashes()
+            stack = [(self.__rootnode, other.__rootnode, '/')]  # nodes to compare and added or removed nodes
+            while stack:
+                item = stack.pop()
+                if len(item) == 5:
+                    ret.append(item)
+                    continue
+                node, other_node, path = item
+                if hashes[node] == other_hashes[other_node]:
+                    continue
+                props = self.__normalized_props(node)
+                other_props = other.__normalized_props(other_node)
+                for prop, value in props.items():
+                    if not prop in other_props:
+                        ret.append(('removed', path, prop, value, None))
+                    elif other_props[prop] != value:
+                        ret.append(('changed', path, prop, value, other_props[prop]))
+                for prop, value in other_props.items():
+                    if not prop in props:
+                        ret.append(('added', path, prop, None, value))
+                subnodes = dict([(subnode.name, subnode) for subnode in self.subnodes(node)])
+                other_subnodes = dict([(subnode.name, subnode) for subnode in other.subnodes(other_node)])
+                prefix = path if path != '/' else ''
+                items = []
+                for name, subnode in subnodes.items():
+                    if not name in other_subnodes:
+                        items.append(('removed', prefix + '/' + name, None, subnode, None))
+                    else:
+                        items.append((subnode, other_subnodes[name], prefix + '/' + name))
+                for name, subnode in other_subnodes.items():
+                    if not name in subnodes:
+                        items.append(('added', prefix + '/' + name, None, None, subnode))
+                stack.extend(reversed(items))
+        return ret
+
+    def __tree_hashes(self):
+        """
+            return {node: hash} built once bottom up, hash covers node name, normalized props and subnode hashes,
+            hashes are only comparable within one process
+        """
+        if self.__hashes is None:
+            self.__build_pathindex()
+            self.__reference_props = dict()  # {prop: #cells prop or None} of props referencing nodes, '' for phandle
+            for prop in self.__propindex:
+                if prop == 'phandle' or prop == 'linux,phandle':
+                    self.__reference_props[prop] = ''
+                    continue
+                match = DTS_REFERENCE_PATTERN.fullmatch(prop)
+                if match:
+                    self.__reference_props[prop] = DTS_REFERENCE_PROPS[match.lastindex - 1][1]
+            self.__hashes = dict()
+            for node in reversed(list(self.__nodeorder)):
+                self.__hashes[node] = hash((node.name, frozenset(self.__normalized_props(node).items()),
+                                            frozenset([self.__hashes[subnode] for subnode in self.subnodes(node)])))
+        return self.__hashes
+
+    def __normalized_props(self, node):
+        """
+            return props of node without phandle, references are rewritten as <&/path 0x1>
+        """
+        props = node.props
+        references = self.__reference_props.keys() & props.keys()
+        if not references:
+            return props
+        ret = dict(props)
+        for prop in references:
+            kind = self.__reference_props[prop]
+            if kind == '':
+                del ret[prop]
+            else:
+                ret[prop] = self.__normalized_references(node.cells(prop), kind) or props[prop]
+        return ret
+
+    def __normalized_references(self, cells, cells_prop):
+        """
+            return '<&/path arg ...>' of cells, None if cells are not phandles followed by their arguments
+        """
+        references = self.__references(cells, cells_prop)
+        if not references:
+            return None
+        ret = []
+        for node, args in references:
+            ret.append('&' + self.__paths[node])
+            ret.extend(['{:#x}'.format(cell) for cell in args])
+        return '<' + ' '.join(ret) + '>'
+
+    def __references(self, cells, cells_prop):
+        """
+            return [(node, args), ...] of cells which are phandles each followed by number of argument cells
+            given by cells_prop of referenced node, every cell is a phandle if cells_prop is None,
+            None if cells are not so
+        """
+        if not cells:
+            return None
+        ret = []
+        i = 0
+        while i < len(cells):
+            node = self.__phandles.get(cells[i])
+            if not node:
+                return None
+            count = 0
+            if cells_prop:
+                count = node.cells(cells_prop)
+                if len(count) != 1 or i + 1 + count[0] > len(cells):
+                    return None
+                count = count[0]
+            ret.append((node, cells[i + 1:i + 1 + count]))
+            i += count + 1
+        return ret
+
     def find_node_by_phandle_recursive(self, node, phandle):
         """
             return sunode or node which phandle is <phandle>, phandle must be a str
@@ -402,13 +1763,12 @@ class Dts():
         if not isinstance(node, Node):
             raise ValueError('phandle must be a Node')
 
-        if 'phandle' in node.props.keys() \
-            and re.search(re.compile('0x[0-9a-fA-F]+'), node.props['phandle']).group(0) == phandle:
-                return node
-        for subnode in node.subnodes:
-            ret = self.find_node_by_phandle_recursive(subnode, phandle)
-            if ret:
+        ret = self.__phandles.get(self.__phandle_key(phandle))
+        ancestor = ret
+        while ancestor:
+            if ancestor == node:
                 return ret
+            ancestor = ancestor.parent
         return None
 
     def find_subnode_by_patternname_recursive(self, node, pattern):
@@ -418,14 +1778,8 @@ class Dts():
         if not isinstance(node, Node):
             raise ValueError('phandle must be a Node')
 
-        ret = []
-        if re.fullmatch(pattern, node.name):
-            ret.append(node)
-        for subnode in node.subnodes:
-            nodes = self.find_subnode_by_patternname_recursive(subnode, pattern)
-            if nodes:
-                ret.extend(nodes)
-        return ret
+        pattern = re.compile(pattern)
+        return [subnode for subnode in iter_nodes(node, self.__prune) if pattern.fullmatch(subnode.name)]
 
     def find_node_statement_by_statementpattern_recursive(self, node, pattern):
         """
@@ -434,100 +1788,409 @@ class Dts():
         if not isinstance(node, Node):
             raise ValueError('node must be a Node')
         ret = dict()
-
-        for prop in node.props.keys():
-            if node.props[prop]:
-                if re.fullmatch(pattern, prop + ' = ' + node.props[prop]):
-                    if node in ret.keys():
-                        ret[node].update({prop: node.props[prop]})
-                    else:
-                        ret[node] = {prop: node.props[prop]}
-            else:
-                if re.fullmatch(pattern, prop):
-                    if node in ret.keys():
-                        ret[node].update({prop: ''})
-                    else:
-                        ret[node] = {prop: ''}
-        for subnode in node.subnodes:
-            ret.update(self.find_node_statement_by_statementpattern_recursive(subnode, pattern))
+        prefix = self.__pattern_prefix(pattern)
+        for subnode in iter_nodes(node, self.__prune):
+            self.__match_node_statement(subnode, pattern, prefix, ret)
         return ret
 
     def get_node_property_gpio_use_recursive(self, node, gpiocontroller_node):
         """
             Return all gpio used of node and its subnode, [(node1, property, gpio), ...]
+            property value is <phandle gpio flags phandle gpio flags ...> with gpiocontroller_node phandle
         """
         ret = []
         if 'phandle' in gpiocontroller_node.props.keys():
-            phandle = re.search(re.compile('0x[0-9a-fA-F]+'), gpiocontroller_node.props['phandle']).group(0)
+            phandle = gpiocontroller_node.cells('phandle')[:1]
             if not phandle:
                 return ret
-            pattern_string = re.compile('<(\s*' + phandle + '\s+0x[0-9a-fA-F]+\s+0x[0-9a-fA-F]+\s*)+>')
-            for prop in node.props:
-                if re.fullmatch(pattern_string, node.props[prop]):
-                    gpio_property = re.findall(re.compile('0x[0-9a-fA-F]+'), node.props[prop])
-                    for gpio in [int(gpio_property[i], 16) for i in range(1, len(gpio_property), 3)]:
-                        ret.append((node, prop, gpio))
-            for subnode in node.subnodes:
-                for item in self.get_node_property_gpio_use_recursive(subnode, gpiocontroller_node):
-                    ret.append(item)
+            phandle = phandle[0]
+            for subnode in iter_nodes(node, self.__prune):
+                for prop in subnode.props:
+                    cells = subnode.cells(prop)
+                    if cells and len(cells) % 3 == 0 and cells[0::3].count(phandle) == len(cells) // 3:
+                        for gpio in cells[1::3]:
+                            ret.append((subnode, prop, gpio))
         else:
             raise ValueError('there is no phandle prop in gpiocontroller_node {}'.format(gpiocontroller_node.name))
 
         return ret
 
-    def __node_parser(self, fd, node_name=None):
-        """
-        Parse node infomation, without nodename and starting '{' but with ending '};'
-
-        nodenmae {
-        ----------------------------------
-            prop1;
-            subnode {
-            };
-            subnode {
-            };
-        };
-        -----------------------------------
-
-        Return node
-        """
-        node = Node()
-        if node_name:
-            node.name = node_name
-        line = fd.readline()
-        while line:
-            if re.fullmatch('\s*\S+\s+{\s*\n', line):  # parse sub node
-                #get node name
-                name = re.search(re.compile('\S+'), line).group(0)
-                subnode = self.__node_parser(fd, name)
-                if self.__with_disabled_node:
-                    node.addsubnode(subnode)
-                elif not subnode.isDisabled():
-                    node.addsubnode(subnode)
-            elif re.fullmatch('\s*};\s*\n', line):  # end sub node:
-                break
-            elif re.sub(re.compile('\s*\n'), '', line):  # statement
-                statement = re.sub(re.compile('\s*;\s*\n'), '', line)
-                node.addstatement(statement.strip())
-            line = fd.readline()
-        return node
+    @staticmethod
+    def __text_chunks(stream):
+        """
+            Generator of str chunks of text stream or iterable of lines, raise TypeError on bytes
+        """
+        chunks = stream
+        if hasattr(stream, 'read'):
+            chunks = iter(lambda: stream.read(DTS_CHUNK_SIZE) or None, None)
+        for chunk in chunks:
+            if not isinstance(chunk, str):
+                raise TypeError('dts stream must give str, not {}, open it in text mode'.format(type(chunk).__name__))
+            yield chunk
+
+    def __node_parser(self, chunks):
+        """
+        Parse dts source text in one pass, each token is a whole statement:
+
+            /dts-v1/;                        directive, ignored
+            label: nodename {                start of node, labels are ignored
+            prop;                            property without value
+            prop = "str", <0x1 0x2>, [01];   property, value is kept as written
+            };                               end of node
+
+        Statements may span lines or share one line, comments are skipped.
+        chunks is an iterable of text pieces, such as lines, they are tokenized as they come
+        in blocks of about DTS_CHUNK_SIZE characters ending at a line end, a statement split
+        between blocks is kept and tokenized again with the next block.
+
+        Return root node
+        """
+        root = None
+        stack = []
+        node = None
+        line = 1  # line number of start of rest
+        rest = ''
+        pending = []
+        size = 0
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                pending.append(chunk)
+                size += len(chunk)
+                if size < DTS_CHUNK_SIZE:
+                    continue
+            text = rest + ''.join(pending)
+            pending = []
+            size = 0
+            end = len(text) if chunk is None else text.rfind('\n') + 1
+            pos = DTS_SPACE_PATTERN.match(text, 0, end).end()
+            error = False
+            for match in DTS_TOKEN_PATTERN.finditer(text, pos, end):
+                if match.start() != pos:
+                    break
+                pos = match.end()
+                name, brace, value, close = match.groups()
+                if name:
+                    if brace:  # start of node
+                        if not stack and name == '/' and root:
+                            subnode = root
+                        else:
+                            subnode = Node()
+                            subnode.name = name
+                        stack.append(subnode)
+                        node = subnode
+                    elif node:
+                        node.addprop(name, value.rstrip() if value else '')
+                    else:  # property outside of node
+                        pos = match.start()
+                        error = True
+                        break
+                elif close:
+                    if not stack:
+                        pos = match.start()
+                        error = True
+                        break
+                    subnode = stack.pop()
+                    node = stack[-1] if stack else None
+                    if subnode is root:
+                        continue
+                    if not node:
+                        if root:
+                            raise ValueError('unsupported top level node {} in dts'.format(subnode.name))
+                        root = subnode
+                    else:
+                        node.addsubnode(subnode)
+            if error or (chunk is None and (pos != len(text) or stack)):
+                raise ValueError('dts syntax error at line {}'.format(line + text.count('\n', 0, pos)))
+            line += text.count('\n', 0, pos)
+            rest = text[pos:]
+        if not root:
+            raise ValueError('no root node in dts')
+        return root
 
     def __dts_parser(self, filename):
         with open(filename, 'r') as fd:
-            line = fd.readline()
-            while line:
-                if re.fullmatch('\s*\S+\s+{\s*\n', line):  # parse / node
-                    #get node name
-                    name = re.search(re.compile('\S+'), line).group(0)
-                    root = self.__node_parser(fd, name)
-                    break
-                line = fd.readline()
+            return self.__node_parser(iter(lambda: fd.read(DTS_CHUNK_SIZE), ''))
+
+    def __is_dtb(self, filename):
+        with open(filename, 'rb') as fd:
+            magic = fd.read(4)
+        return len(magic) == 4 and struct.unpack('>I', magic)[0] == FDT_MAGIC
+
+    def __dtb_parser(self, filename):
+        """
+            Parse flattened device tree blob into Node tree without dtc,
+            property values are formatted the same as dtc -I dtb -O dts
+        """
+        with open(filename, 'rb') as fd:
+            blob = fd.read()
+        if len(blob) < 40:
+            raise ValueError('{} is too short for a dtb file'.format(filename))
+        magic, totalsize, off_dt_struct, off_dt_strings, off_mem_rsvmap, version, last_comp_version, \
+            boot_cpuid_phys, size_dt_strings = struct.unpack_from('>9I', blob, 0)
+        if magic != FDT_MAGIC:
+            raise ValueError('{} is not a dtb file'.format(filename))
+        if last_comp_version > 17 or totalsize > len(blob):
+            raise ValueError('unsupported or truncated dtb file {}, version {}'.format(filename, version))
+        strings = blob[off_dt_strings:off_dt_strings + size_dt_strings]
+
+        root = None
+        stack = []
+        pos = off_dt_struct
+        while True:
+            token = struct.unpack_from('>I', blob, pos)[0]
+            pos += 4
+            if token == FDT_BEGIN_NODE:
+                end = blob.index(b'\0', pos)
+                node = Node()
+                node.name = blob[pos:end].decode('latin-1') or '/'
+                pos = (end + 4) & ~3
+                stack.append(node)
+            elif token == FDT_END_NODE:
+                node = stack.pop()
+                if not stack:
+                    root = node
+                else:
+                    stack[-1].addsubnode(node)
+            elif token == FDT_PROP:
+                length, nameoff = struct.unpack_from('>2I', blob, pos)
+                pos += 8
+                name = strings[nameoff:strings.index(b'\0', nameoff)].decode('latin-1')
+                stack[-1].addprop(name, self.__dtb_propvalue(blob[pos:pos + length]))
+                pos = (pos + length + 3) & ~3
+            elif token == FDT_NOP:
+                continue
+            elif token == FDT_END:
+                break
+            else:
+                raise ValueError('bad dtb token {:#x} at offset {:#x} in {}'.format(token, pos - 4, filename))
+        if root is None:
+            raise ValueError('no root node in dtb file {}'.format(filename))
         return root
 
+    def __dtb_propvalue(self, data):
+        """
+            format property data as dtc does, "str1", "str2" or <0x1 0x2> or [01 02], b'' is ''
+        """
+        if not data:
+            return ''
+        nnul = data.count(0)
+        if data[-1] == 0 and nnul < len(data) - nnul \
+                and all(c == 0 or 32 <= c < 127 or 7 <= c <= 13 for c in data):
+            escapes = {7: '\\a', 8: '\\b', 9: '\\t', 10: '\\n', 11: '\\v', 12: '\\f', 13: '\\r',
+                       0x5c: '\\\\', 0x22: '\\"', 0: '", "'}
+            return ''.join(['"', ''.join([escapes.get(c) or chr(c) for c in data[:-1]]), '"'])
+        if len(data) % 4 == 0:
+            cells = struct.unpack('>{}I'.format(len(data) // 4), data)
+            return ''.join(['<', ' '.join(['{:#x}'.format(cell) for cell in cells]), '>'])
+        return ''.join(['[', ' '.join(['{:02x}'.format(c) for c in data]), ']'])
+
 
-def search_dtc_dtbs():
+class LazyDts():
+    """
+        Dts file for point queries such as find_node_by_phandle, the file is memory mapped and only
+        pre-scanned for node braces, phandles and disabled status. Nodes are LazyNode, statements of
+        a node are tokenized when the node is first used, so a query only parses the nodes on its path.
+        Braces must not be inside comments spanning lines, as dtc output, use Dts for whole tree analysis.
+    """
+    def __init__(self, filename, with_disabled_node=False):
+        self.__with_disabled_node = with_disabled_node
+        with open(filename, 'rb') as fd:
+            self.__data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__nodes = dict()  # {index: node} of nodes created so far
+        try:
+            self.__prescan()
+        except Exception:
+            self.__data.close()
+            raise
+        self.__rootnode = LazyNode(self.__loader(0))
+        names = self.__tokenize(0, self.__opens[0], None)[1]
+        self.__rootnode.name = names[-1]
+        self.__nodes[0] = self.__rootnode
+
+    def close(self):
+        self.__data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __prescan(self):
+        """
+            index nodes in tree order, node i is between __opens[i] (after '{') and __ends[i] (at '}'),
+            __closes[i] is after its '};', __parents[i] and __children[i] are indexes
+        """
+        data = self.__data
+        self.__opens = []
+        self.__ends = []
+        self.__closes = []
+        self.__parents = []
+        self.__children = []
+        stack = []
+        braces = []
+        for brace in (b'{', b'}'):
+            pos = data.find(brace)
+            while pos >= 0:
+                braces.append(pos)
+                pos = data.find(brace, pos + 1)
+        braces.sort()
+        skips = []  # strings and comments of current line, [(start, end), ...]
+        linestart = -1
+        for pos in braces:
+            start = data.rfind(b'\n', 0, pos) + 1
+            if start != linestart:
+                linestart = start
+                skips = []
+                if data.find(b'"', start, pos) >= 0 or data.find(b'/', start, pos) >= 0:
+                    end = data.find(b'\n', pos)
+                    skips = [skip.span() for skip in DTS_LINE_SKIP_PATTERN.finditer(data, start, len(data) if end < 0 else end)]
+            if skips and [skip for skip in skips if skip[0] < pos < skip[1]]:
+                continue
+            if data[pos] == 0x7b:  # {
+                index = len(self.__opens)
+                self.__opens.append(pos + 1)
+                self.__ends.append(None)
+                self.__closes.append(None)
+                self.__parents.append(stack[-1] if stack else None)
+                self.__children.append([])
+                if stack:
+                    self.__children[stack[-1]].append(index)
+                elif index:
+                    raise ValueError('lazy parsing supports only one top level node, use Dts')
+                stack.append(index)
+            else:
+                if not stack:
+                    raise ValueError('dts syntax error at line {}'.format(self.__line(pos)))
+                index = stack.pop()
+                self.__ends[index] = pos
+                self.__closes[index] = data.find(b';', pos) + 1
+        if stack or not self.__opens:
+            raise ValueError('dts syntax error at line {}'.format(self.__line(len(data))))
+        self.__phandles = dict()  # {0x45: index}
+        for match in DTS_PHANDLE_PATTERN.finditer(data):
+            start = match.start()
+            if data[start - 6:start] == b'linux,':
+                start -= 6
+            if start == 0 or data[start - 1] in b' \t\n;{':
+                self.__phandles.setdefault(phandle_number(match.group(1)), self.__node_at(start))
+        self.__disabled = set()
+        for match in DTS_DISABLED_PATTERN.finditer(data):
+            start = match.start()
+            if start == 0 or data[start - 1] in b' \t\n;{':
+                self.__disabled.add(self.__node_at(start))
+
+    def __node_at(self, pos):
+        """
+            return index of innermost node containing pos
+        """
+        index = bisect.bisect_right(self.__opens, pos) - 1
+        while index is not None and self.__ends[index] < pos:
+            index = self.__parents[index]
+        return index
+
+    def __line(self, pos):
+        return self.__data[:pos].count(b'\n') + 1
+
+    def __tokenize(self, start, end, node):
+        """
+            add statements between start and end to node, return (pos, names of nodes started)
+        """
+        text = self.__data[start:end].decode()
+        names = []
+        pos = DTS_SPACE_PATTERN.match(text).end()
+        for match in DTS_TOKEN_PATTERN.finditer(text, pos):
+            if match.start() != pos:
+                break
+            name, brace, value, close = match.groups()
+            if close or (name and not brace and not node):
+                break
+            pos = match.end()
+            if brace:
+                names.append(name)
+            elif name:
+                node.addprop(name, value.rstrip() if value else '')
+        if pos != len(text):
+            raise ValueError('dts syntax error at line {}'.format(self.__line(start + len(text[:pos].encode()))))
+        return (pos, names)
+
+    def __loader(self, index):
+        return lambda node: self.__load(node, index)
+
+    def __load(self, node, index):
+        """
+            parse statements of node index, its subnodes are created but not loaded
+        """
+        start = self.__opens[index]
+        for child in self.__children[index]:
+            names = self.__tokenize(start, self.__opens[child], node)[1]
+            if len(names) != 1:
+                raise ValueError('dts syntax error at line {}'.format(self.__line(self.__opens[child])))
+            if self.__with_disabled_node or not child in self.__disabled:
+                subnode = LazyNode(self.__loader(child))
+                subnode.name = names[0]
+                node.addsubnode(subnode)
+                self.__nodes[child] = subnode
+            start = self.__closes[child]
+        if self.__tokenize(start, self.__ends[index], node)[1]:
+            raise ValueError('dts syntax error at line {}'.format(self.__line(self.__ends[index])))
+
+    def dump(self):
+        return self.__rootnode.dump(withdisabled=True)
+
+    def iter_nodes(self, prune=None):
+        """
+            Generator of all nodes in tree order, see iter_nodes, nodes are loaded as they are visited
+        """
+        return iter_nodes(self.__rootnode, prune)
+
+    def iter_props(self, prune=None):
+        """
+            Generator of (node, prop, value) of all nodes in tree order, see iter_props
+        """
+        return iter_props(self.__rootnode, prune)
+
+    def find_node_by_patternname(self, pattern):
+        """
+            return list of subnode which name fully matches pattern, all nodes are loaded
+        """
+        pattern = re.compile(pattern)
+        return [node for node in iter_nodes(self.__rootnode) if pattern.fullmatch(node.name)]
+
+    def get_platform(self):
+        return Platform.from_compatible(self.__rootnode.props.get('compatible', ''))
+
+    def find_node_by_phandle(self, phandle):
+        """
+            phandle is a str as 0x45 or <0x45>, or an int, only the node and its ancestors are loaded
+        """
+        if isinstance(phandle, int):
+            key = phandle
+        else:
+            value = re.search(re.compile('0x[0-9a-fA-F]+|[0-9]+'), phandle)
+            key = phandle_number(value.group(0)) if value else None
+        index = self.__phandles.get(key)
+        path = []
+        while index is not None:
+            path.append(index)
+            index = self.__parents[index]
+        node = None
+        for index in reversed(path):
+            if node:
+                node.subnodes
+            node = self.__nodes.get(index)
+            if not node:
+                break
+        if node and key in node.cells('phandle') + node.cells('linux,phandle'):
+            return node
+        print('node with phandle = <{}> is not found, please check'.format(phandle))
+        return None
+
+
+def search_dtc_dtbs(with_dtc=False):
     """
     This script is excuted in android root directory, so check the path is valid
+    dtc command is only searched if with_dtc is True, dtb files are read natively otherwise
     """
     rootdir_contents = os.listdir()
     dirs_check = {'kernel', 'device', 'vendor', 'cts', 'external', 'frameworks'}
@@ -540,12 +2203,15 @@ def search_dtc_dtbs():
         print(errmsg)
         exit()
     print('searching dtc command and dtb files, please wait......')
-    with os.popen('find ./out/ -name dtc -type f 2>/dev/null') as fd:
-        dtc_find_list = fd.read()
-    dtc_find_list = dtc_find_list.split()
+    dtc_find_list = []
+    if with_dtc:
+        with os.popen('find ./out/ -name dtc -type f 2>/dev/null') as fd:
+            dtc_find_list = fd.read()
+        dtc_find_list = dtc_find_list.split()
     with os.popen('find ./out/target/product/ -name *.dtb -type f 2>/dev/null') as fd:
         dtb_find_list = fd.read()
     dtb_find_list = dtb_find_list.split()
+    dtc_command = None
     for dtc_file in dtc_find_list:
         dtc_command = re.search(re.compile('.*out/.*/dtc'), dtc_file)
         if dtc_command:
@@ -554,7 +2220,7 @@ def search_dtc_dtbs():
                 help_msg = fd.read()
             if re.search(re.compile('(device tree blob)|(device tree source text)'), help_msg):
                 break
-    if not dtc_command:
+    if with_dtc and not dtc_command:
         raise ValueError('no dtc command found')
     dtbs = []
     for dtb_file in dtb_find_list:
@@ -567,28 +2233,523 @@ def search_dtc_dtbs():
     return (dtc_command, dtbs)
 
 
+def write_gpio_records(fd, records, format='jsonl', fields=GPIO_RECORD_FIELDS):
+    """
+    Write records one by one to text file fd as they are generated, Return number of records
+        format is 'jsonl', one json object per line, or 'csv' with a header line of fields
+        records are dicts such as Dts.iter_gpio_usage_records, only keys in fields are written
+    """
+    count = 0
+    if format == 'jsonl':
+        for record in records:
+            fd.write(json.dumps(dict([(field, record.get(field)) for field in fields])) + '\n')
+            count += 1
+    elif format == 'csv':
+        writer = csv.DictWriter(fd, fields, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            count += 1
+    else:
+        raise ValueError('unknown gpio record format {}'.format(format))
+    return count
+
+
+def scan_gpio_sources(files, pinctrl_files=(), gpios=None):
+    """
+    Read each source file once and index gpio references in it, msm_gpio N in files, and gpN in pinctrl_files too
+    Return {gpio: [(file, line number, line), ...]} sorted by gpio, locations are in order of files and lines,
+        a line is listed once for each gpio it references, gpios not in gpios are dropped if it is set
+    """
+    ret = dict()
+    patterns = [(filename, DTS_GPIO_SOURCE_PATTERN) for filename in dict.fromkeys(files)]
+    patterns += [(filename, DTS_PINCTRL_SOURCE_PATTERN) for filename in dict.fromkeys(pinctrl_files)]
+    for filename, pattern in patterns:
+        try:
+            with open(filename, 'rb') as fd:
+                text = fd.read()
+        except OSError:
+            continue
+        line = 1
+        pos = 0
+        for match in pattern.finditer(text):
+            gpio = int(match.group(1))
+            if gpios is not None and not gpio in gpios:
+                continue
+            line += text.count(b'\n', pos, match.start())
+            pos = match.start()
+            start = text.rfind(b'\n', 0, pos) + 1
+            end = text.find(b'\n', pos)
+            location = (filename, line, text[start:end if end >= 0 else len(text)].decode('utf-8', 'replace'))
+            locations = ret.setdefault(gpio, [])
+            if not location in locations[-1:]:
+                locations.append(location)
+    return dict(sorted(ret.items()))
+
+
+def process_dtb(dtb_file, dtc_command=None, cache=None, format='text'):
+    """
+    Parse dtb_file and save its gpio usage to xxx_gpio_use.txt, or .jsonl or .csv by format, see write_gpio_records, dtb_file is decompiled by dtc_command if it is set
+    and its output is parsed while dtc is running, otherwise it is read directly and its parsed tree is kept in ParseCache cache if it is set
+    Return: (dtb_file, result_file, error, output, stats)
+        error is None or str, output is the text printed while processing, stats is Stats of all phases
+    """
+    result_file = re.sub(re.compile('\\.dtb'), '_gpio_use' + GPIO_REPORT_FORMATS[format], dtb_file)
+    stats = Stats()
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            if dtc_command:
+                with subprocess.Popen([dtc_command, '-I', 'dtb', '-O', 'dts', dtb_file], stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL, universal_newlines=True) as dtc:
+                    try:
+                        dts = Dts(dtc.stdout, stats=stats)
+                    finally:
+                        dtc.stdout.close()
+                        if dtc.wait() > 0:
+                            raise ValueError('{} failed to decompile {}, exit status {}'.format(dtc_command, dtb_file, dtc.returncode))
+            else:
+                dts = Dts(dtb_file, cache=cache, stats=stats)
+            if format == 'text':
+                msg = dts.dump_gpio_interrupt_pinctrl_usage()
+                with stats.phase('write'):
+                    with open(result_file, 'w') as fd:
+                        fd.write(msg)
+            else:
+                with stats.phase('write'):
+                    with open(result_file, 'w', newline='') as fd:
+                        write_gpio_records(fd, dts.iter_gpio_usage_records(), format)
+    except Exception as e:
+        return (dtb_file, None, '{}: {}'.format(type(e).__name__, e), output.getvalue(), stats)
+    return (dtb_file, result_file, None, output.getvalue(), stats)
+
+
+def process_dtbs(dtbs, dtc_command=None, jobs=1, cache=None, format='text'):
+    """
+    Generator of process_dtb results in the order of dtbs, dtb files are processed by jobs worker processes if jobs > 1
+    """
+    if jobs <= 1 or len(dtbs) <= 1:
+        for dtb_file in dtbs:
+            yield process_dtb(dtb_file, dtc_command, cache, format)
+        return
+    with ProcessPoolExecutor(max_workers=min(jobs, len(dtbs))) as executor:
+        for result in executor.map(process_dtb, dtbs, itertools.repeat(dtc_command), itertools.repeat(cache),
+                                   itertools.repeat(format)):
+            yield result
+
+
+class DtsServer():
+    """
+        Keep parsed Dts trees in memory and answer queries on a unix socket, one json object per line:
+            request   {"file": "board.dts", "query": "select", "arg": "soc/*[status=\\"okay\\"]", "with_disabled_node": false}
+            response  {"result": ...} or {"error": "ValueError: ..."}
+        queries, nodes are given and returned as paths:
+            gpio_usage          records of Dts.iter_gpio_usage_records
+            phandle, arg        path of node with phandle, such as "0x45", null if it is not found
+            path, arg           {"path": path, "props": {prop: value, ...}, "subnodes": [name, ...]} of node
+                                with path or label, null if it is not found
+            pattern, arg        paths of nodes whose name fully matches arg, see Dts.find_node_by_patternname
+            select, arg         paths of nodes matching selector, see Selector
+            dump, arg           text of node with path or label and its subnodes
+        file is parsed when it is first queried, and again only when its mtime or size and its contents changed
+    """
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.__trees = dict()  # {path: (stat, sha256, Dts)}, both views share one parse
+        self.__lock = threading.Lock()
+        self.__server = None
+
+    def tree(self, filename, with_disabled_node=False):
+        """
+            return Dts view of filename, parsed again if file is changed since it was parsed
+        """
+        key = os.path.abspath(filename)
+        stat = os.stat(key)
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if key in self.__trees:
+            old_stat, old_digest, dts = self.__trees[key]
+            if old_stat == stat:
+                return dts.view(with_disabled_node)
+        digest = hashlib.sha256()
+        with open(key, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        if key in self.__trees and old_digest == digest:
+            self.__trees[key] = (stat, digest, dts)
+            return dts.view(with_disabled_node)
+        dts = Dts(key, with_disabled_node=with_disabled_node, cache=self.cache)
+        self.__trees[key] = (stat, digest, dts)
+        return dts
+
+    def query(self, request):
+        """
+            Return response dict of request dict, see DtsServer
+        """
+        try:
+            with self.__lock, contextlib.redirect_stdout(io.StringIO()):
+                return {'result': self.__query(request)}
+        except Exception as e:
+            return {'error': '{}: {}'.format(type(e).__name__, e)}
+
+    def __query(self, request):
+        if not isinstance(request, dict) or not isinstance(request.get('file'), str):
+            raise ValueError('request must be a json object with file')
+        with_disabled_node = bool(request.get('with_disabled_node', False))
+        dts = self.tree(request['file'], with_disabled_node)
+        query = request.get('query')
+        arg = request.get('arg')
+        if query == 'gpio_usage':
+            return list(dts.iter_gpio_usage_records())
+        if not isinstance(arg, str):
+            raise ValueError('query {} needs str arg'.format(query))
+        if query == 'phandle':
+            node = dts.find_node_by_phandle(arg)
+            return dts.path(node) if node else None
+        if query == 'path':
+            node = dts.node(arg)
+            if not node:
+                return None
+            return {'path': dts.path(node), 'props': dict(node.props), 'subnodes': [subnode.name for subnode in dts.subnodes(node)]}
+        if query == 'pattern':
+            return [dts.path(node) for node in dts.find_node_by_patternname(arg)]
+        if query == 'select':
+            return [dts.path(node) for node in dts.select(arg)]
+        if query == 'dump':
+            node = dts.node(arg)
+            if not node:
+                raise ValueError('node {} is not found'.format(arg))
+            return node.dump(withdisabled=with_disabled_node)
+        raise ValueError('unknown query {}'.format(query))
+
+    def serve(self, path):
+        """
+            Answer requests on unix socket path until shutdown is called, path is replaced if it is a socket
+            Raise ValueError if path exists and is not a socket
+        """
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = server.query(json.loads(line))
+                    except ValueError as e:
+                        response = {'error': 'ValueError: bad json request, {}'.format(e)}
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+
+        try:
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise ValueError('{} exists and is not a socket'.format(path))
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as self.__server:
+            try:
+                self.__server.serve_forever()
+            finally:
+                os.unlink(path)
+
+    def shutdown(self):
+        if self.__server:
+            self.__server.shutdown()
+
+
+def query_server(path, request):
+    """
+    Send request dict to DtsServer listening on unix socket path, Return result of response
+    file of request is made absolute here, so it is relative to working directory of caller
+    Raise ValueError with error of response if request failed
+    """
+    if isinstance(request, dict) and isinstance(request.get('file'), str):
+        request = dict(request, file=os.path.abspath(request['file']))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as fd:
+            response = json.loads(fd.readline())
+    if 'error' in response:
+        raise ValueError(response['error'])
+    return response['result']
+
+
+class IncludeGraph():
+    """
+        Graph of #include "file" of dts and dtsi source files. #include lines of a file are read once and
+        kept until mtime or size of file changes, files not read yet are read by jobs threads in parallel.
+        An included file is searched in base directory, which is directory of including file or
+        directory of top dts file for dtsi_check_order, and then in include_dirs. Include cycles are cut
+    """
+    def __init__(self, include_dirs=(), jobs=4):
+        self.include_dirs = list(include_dirs)
+        self.jobs = jobs
+        self.__includes = dict()  # {path: ((mtime, size), [included file, ...])}, file as written in #include
+
+    def includes(self, filename):
+        """
+            Return included files of filename as written in #include lines, [] if it can't be read
+        """
+        self.__update([filename])
+        return list(self.__includes[os.path.normpath(filename)][1])
+
+    def reachable(self, filename):
+        """
+            Return paths of all files included by filename directly or indirectly, in order of first #include,
+            files included by an included file come right after it, filename itself is not listed
+        """
+        return [path for path, depth in self.__walk(filename, None, unique=True)][1:]
+
+    def included_by(self, filename, roots):
+        """
+            Return files of roots, such as dts files, which include filename directly or indirectly, in order of roots
+        """
+        target = os.path.normpath(filename)
+        self.__update(roots)
+        included_by = dict()  # {path: set of paths including it directly}
+        for path, (stat, names) in self.__includes.items():
+            for name in names:
+                included_by.setdefault(self.__resolve(name, os.path.dirname(path)), set()).add(path)
+        reaching = set()  # paths target is reachable from, include cycles are walked once
+        queue = collections.deque([target])
+        while queue:
+            for path in included_by.get(queue.popleft(), ()):
+                if not path in reaching:
+                    reaching.add(path)
+                    queue.append(path)
+        return [root for root in roots if os.path.normpath(root) in reaching]
+
+    def dtsi_check_order(self, dts):
+        """
+            Return lines printed by dtsi_check.sh dts: name of dts, then every #include "file" as written,
+            depth first, a file is listed again each time it is included. Files are searched in directory of dts
+        """
+        return [os.path.basename(dts)] + [name for name, depth in self.__walk(dts, os.path.dirname(dts), unique=False)][1:]
+
+    def __walk(self, filename, base_dir, unique):
+        """
+            Generator of (path, depth) depth first from filename, path is the file as written for base_dir set,
+            otherwise normalized path. A file is walked once if unique, otherwise once per #include not in a cycle
+        """
+        filename = os.path.normpath(filename)
+        self.__update([filename], base_dir)
+        seen = set()
+        stack = [(filename, filename, 0, ())]
+        while stack:
+            name, path, depth, ancestors = stack.pop()
+            if unique:
+                if path in seen:
+                    continue
+                seen.add(path)
+            yield (name if base_dir is not None else path, depth)
+            if path in ancestors:
+                continue
+            ancestors += (path,)
+            children = []
+            for child in self.__includes.get(path, (None, []))[1]:
+                child_path = self.__resolve(child, base_dir if base_dir is not None else os.path.dirname(path))
+                children.append((child, child_path, depth + 1, ancestors))
+            stack.extend(reversed(children))
+
+    def __resolve(self, name, base_dir):
+        path = os.path.normpath(os.path.join(base_dir, name))
+        if not os.path.isfile(path):
+            for directory in self.include_dirs:
+                candidate = os.path.normpath(os.path.join(directory, name))
+                if os.path.isfile(candidate):
+                    return candidate
+        return path
+
+    def __update(self, filenames, base_dir=None):
+        """
+            read #include lines of filenames and files they include, which are not read or changed since read
+        """
+        seen = set()
+        frontier = [os.path.normpath(filename) for filename in filenames]
+        with ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as executor:
+            while frontier:
+                frontier = [path for path in dict.fromkeys(frontier) if not path in seen]
+                seen.update(frontier)
+                stale = []
+                for path in frontier:
+                    try:
+                        stat = os.stat(path)
+                        stat = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        stat = None
+                    if not path in self.__includes or self.__includes[path][0] != stat:
+                        stale.append((path, stat))
+                scan = lambda item: (item[0], (item[1], self.__scan(item[0]) if item[1] else []))
+                for path, entry in (executor.map(scan, stale) if self.jobs > 1 and len(stale) > 1 else map(scan, stale)):
+                    self.__includes[path] = entry
+                children = []
+                for path in frontier:
+                    directory = base_dir if base_dir is not None else os.path.dirname(path)
+                    children.extend([self.__resolve(name, directory) for name in self.__includes[path][1]])
+                frontier = children
+
+    def __scan(self, path):
+        try:
+            with open(path, 'rb') as fd:
+                text = fd.read()
+        except OSError:
+            return []
+        return [match.group(1).decode('utf-8', 'replace') for match in DTS_INCLUDE_PATTERN.finditer(text)]
+
+
 if __name__ == "__main__":
     parser = ArgumentParser(description="Parse gpio configuration in compiled dtb file")
-    parser.add_argument("-f", metavar='compiled_dtsfile', nargs=1, type=str, required=False, help="Set dts file, which is processed by dtc command")
+    parser.add_argument("-f", metavar='compiled_dtsfile', nargs=1, type=str, required=False, help="Set dts file, which is processed by dtc command, or dtb file")
+    parser.add_argument("--dtc", action='store_true', help="Decompile dtb files with dtc found in out directory instead of reading them directly")
+    parser.add_argument("--no-cache", action='store_true', help="Always parse input files, don't use parse cache")
+    parser.add_argument("--cache-dir", metavar='dir', type=str, help="Set parse cache directory, default is $DTSPARSER_CACHE_DIR or ~/.cache/dtsparser")
+    parser.add_argument("-j", "--jobs", metavar='N', type=int, default=1, help="Process dtb files with N worker processes, 0 is cpu count")
+    parser.add_argument("--diff", metavar=('old', 'new'), nargs=2, type=str,
+                        help="Print added, removed and changed nodes and properties of new against old dts or dtb file")
+    parser.add_argument("--overlay", metavar='dtbo_file', nargs='+', type=str,
+                        help="Apply compiled overlays, dtbo files or dts decompiled from them, to -f file in order")
+    parser.add_argument("--select", metavar='selector', type=str,
+                        help="Print path of nodes of -f file matching selector, such as 'soc/*[status!=\"disabled\"] @pinctrl-0'")
+    parser.add_argument("--conflicts", action='store_true',
+                        help="Print only gpios of -f file used by more than one node, exit status is 1 if there is any")
+    parser.add_argument("--format", choices=list(GPIO_REPORT_FORMATS), default='text',
+                        help="Set gpio usage report format, jsonl and csv have one record per use, default is text")
+    parser.add_argument("--serve", metavar='socket', type=str,
+                        help="Keep parsed trees and answer json queries on unix socket, -f file is parsed at start, see DtsServer")
+    parser.add_argument("--query", metavar=('socket', 'request'), nargs=2, type=str,
+                        help="Send json request to server on unix socket and print json result, such as "
+                             "'{\"file\": \"board.dts\", \"query\": \"phandle\", \"arg\": \"0x45\"}'")
+    parser.add_argument("--includes", metavar='dts_file', type=str,
+                        help="Print dts file name and its #include files depth first as dtsi_check.sh does")
+    parser.add_argument("--gpio-sources", metavar='file', nargs='+', type=str,
+                        help="Print msm_gpio N references in dts file and its #include files, and gpN references in "
+                             "pinctrl dtsi files following it, for each gpio, as gpio_check.sh does")
+    parser.add_argument("--gpios", metavar='first-last', type=str,
+                        help="Set gpio range of --gpio-sources, such as 0-112, every gpio found is printed if not set")
+    parser.add_argument("--profile", metavar='prof_file', nargs='?', const='', type=str,
+                        help="Print time, calls and visited nodes of each phase, save cProfile stats to prof_file if set, "
+                             "worker processes of -j are not covered by cProfile")
     command = parser.parse_args()
+    cache = None if command.no_cache else ParseCache(command.cache_dir)
+    profiler = None
+    if command.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-    if command.f:
-        dts = Dts(command.f[0])
-        msg = dts.dump_gpio_interrupt_pinctrl_usage()
-        print(msg)
+    if command.serve:
+        server = DtsServer(cache)
+        if command.f:
+            server.tree(command.f[0])
+        try:
+            server.serve(command.serve)
+        except KeyboardInterrupt:
+            pass
+        exit()
+
+    if command.query:
+        try:
+            print(json.dumps(query_server(command.query[0], json.loads(command.query[1])), indent=1))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+        exit()
+
+    if command.includes:
+        if not os.path.isfile(command.includes):
+            print('{}: no such file'.format(command.includes))
+            exit()
+        for name in IncludeGraph().dtsi_check_order(command.includes):
+            print(name)
+        exit()
+
+    if command.gpio_sources:
+        dts = command.gpio_sources[0]
+        if not os.path.isfile(dts):
+            print('{}: no such file'.format(dts))
+            exit()
+        directory = os.path.dirname(dts)
+        files = [dts] + [os.path.join(directory, name) for name in IncludeGraph().dtsi_check_order(dts)[1:]]
+        gpios = None
+        if command.gpios:
+            first, dash, last = command.gpios.partition('-')
+            gpios = range(int(first), int(last or first) + 1)
+        locations = scan_gpio_sources(files, command.gpio_sources[1:], gpios)
+        for gpio in gpios if gpios is not None else locations:
+            print('checking gpio {}'.format(gpio))
+            for filename, line, text in locations.get(gpio, []):
+                print('{}:{}:{}'.format(filename, line, text))
+        exit()
+
+    if command.diff:
+        old, new = [Dts(file, cache=cache) for file in command.diff]
+        for change, path, prop, old_value, new_value in old.diff(new):
+            if prop is None:
+                print('{} {}'.format(change, path))
+            elif old_value is None:
+                print('{} {}: +{} = {}'.format(change, path, prop, new_value))
+            elif new_value is None:
+                print('{} {}: -{} = {}'.format(change, path, prop, old_value))
+            else:
+                print('{} {}: {}: {} -> {}'.format(change, path, prop, old_value, new_value))
         exit()
 
-    dtc_command, dtbs = search_dtc_dtbs()
-    for dtb_file in dtbs:
+    if command.f:
+        dts = Dts(command.f[0], cache=cache)
+        status = 0
+        for overlay in command.overlay or []:
+            dts.apply_overlay(overlay)
+        if command.select is not None:
+            try:
+                nodes = dts.select(command.select)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                exit(1)
+            for node in nodes:
+                print(dts.path(node))
+        elif command.conflicts:
+            records = list(dts.iter_gpio_conflict_records())
+            if command.format != 'text':
+                write_gpio_records(sys.stdout, records, command.format)
+            else:
+                gpio = None
+                for record in records:
+                    if (record['controller'], record['gpio']) != gpio:
+                        gpio = (record['controller'], record['gpio'])
+                        print('{} gpio {} is used by more than one node:'.format(*gpio))
+                    print('\t{} {} -> {}'.format(record['kind'], record['consumer'], record['prop']))
+            status = 1 if records else 0
+        elif command.format != 'text':
+            write_gpio_records(sys.stdout, dts.iter_gpio_usage_records(), command.format)
+        else:
+            msg = dts.dump_gpio_interrupt_pinctrl_usage()
+            print(msg)
+        if command.profile is not None:
+            print(dts.stats.report(), end='', file=sys.stderr)
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(command.profile)
+        exit(status)
+
+    dtc_command, dtbs = search_dtc_dtbs(with_dtc=command.dtc)
+    jobs = command.jobs if command.jobs > 0 else os.cpu_count()
+    start = time.perf_counter()
+    failed = 0
+    total_stats = Stats()
+    for dtb_file, result_file, error, output, stats in process_dtbs(dtbs, dtc_command, jobs, cache, command.format):
         print('parsing {0} ......'.format(dtb_file))
-        with os.popen(dtc_command + ' -I dtb -O dts ' + dtb_file + ' 2>/dev/null') as fd:
-            dtsfile = tempfile.mkstemp(suffix='dtstmpfile')
-            with open(dtsfile[1], 'w') as tfd:
-                tfd.write(fd.read())
-        dts = Dts(dtsfile[1])
-        os.unlink(dtsfile[1])
-        result_file = re.sub(re.compile('\.dtb'), '_gpio_use.txt', dtb_file)
-        with open(result_file, 'w') as fd:
-            fd.write(dts.dump_gpio_interrupt_pinctrl_usage())
-        print('saved result to ', result_file)
-        print()     
+        print(output, end='')
+        if error:
+            failed += 1
+            print('failed to parse {}: {}'.format(dtb_file, error))
+        else:
+            print('saved result to ', result_file)
+        print()
+        total_stats.merge(stats)
+    print('{} dtb files, {} failed, {} jobs, {:.2f}s elapsed'.format(len(dtbs), failed, jobs, time.perf_counter() - start))
+    for phase in ('cache', 'parse', 'index', 'dump_gpio_interrupt_pinctrl_usage', 'write'):
+        if phase in total_stats.phases:
+            print('\t{}: {:.2f}s'.format(phase, total_stats.seconds(phase)))
+    if command.profile is not None:
+        print(total_stats.report(), end='')
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(command.profile)
@@ -2,7 +2,9 @@
 #Author zhangbo10073794
 #set -x
 
-#gpio_check.sh xxx.dts
+#gpio_check.sh xxx.dts [gpio_num] [pinctrl_dtsi]
+#print references of gpio 0 to gpio_num in xxx.dts and its #include files, and in pinctrl_dtsi,
+#each file is read once by dtsparser.py --gpio-sources
 
 if [ $# -lt 1 ]; then
 	echo "please set dts file: $(basename $0) xxx.dts"
@@ -17,17 +19,12 @@ if [ ! -f $FILE ]; then
 fi
 
 DIR=$(dirname $1)
-files=$(${DIR}/dtsi_check.sh $FILE)
+GPIO_NUM=${2:-112}
+PINCTRL=${3:-${DIR}/msm8909-pinctrl.dtsi}
 
-#gpio_check.sh xxx.dts
-GPIO_NUM=112
-gpio=0
-while [ $gpio -le ${GPIO_NUM} ]; do
-	echo "checking gpio $gpio"
-	for file in $files
-	do
-		grep -rn -H "msm_gpio[[:space:]]*${gpio}[[:space:]]" ${DIR}/$file
-	done
-	grep -rn -H "gp[[:space:]]*${gpio}[^0-9]" ${DIR}/msm8909-pinctrl.dtsi
-	gpio=$(($gpio+1))
-done
+DTSPARSER=$(dirname $0)/dtsparser.py
+if [ ! -x $DTSPARSER ]; then
+	DTSPARSER=dtsparser.py
+fi
+
+exec $DTSPARSER --gpio-sources $FILE $PINCTRL --gpios 0-${GPIO_NUM}
@@ -6,6 +6,70 @@ import os
 import dtsparser
 import re
 import cProfile
+import struct
+import tempfile
+import io
+import stat
+import json
+import csv
+import threading
+import time
+import subprocess
+
+
+def dtb_propdata(value):
+    """
+        encode dtc formatted property value, "str", <0x1 0x2> or [01 02], into dtb property data
+    """
+    data = []
+    escapes = {'a': '\a', 'b': '\b', 't': '\t', 'n': '\n', 'v': '\v', 'f': '\f', 'r': '\r'}
+    for string, cells, bytestring in re.findall(re.compile(r'"((?:[^"\\]|\\.)*)"|<([^>]*)>|\[([^\]]*)\]'), value):
+        if cells:
+            data.append(b''.join([struct.pack('>I', int(cell, 0)) for cell in cells.split()]))
+        elif bytestring:
+            data.append(bytes.fromhex(bytestring))
+        else:
+            string = re.sub(re.compile(r'\\x([0-9a-fA-F]{2})|\\(.)'),
+                            lambda m: chr(int(m.group(1), 16)) if m.group(1) else escapes.get(m.group(2), m.group(2)), string)
+            data.append(string.encode('latin-1') + b'\0')
+    return b''.join(data)
+
+
+def make_dtb(rootnode):
+    """
+        return flattened device tree blob of rootnode, version 17
+    """
+    structure = []
+    strings = []
+    stringoffs = dict()
+
+    def pad(data):
+        return data + b'\0' * (-len(data) % 4)
+
+    def add_node(node):
+        name = '' if node.name == '/' else node.name
+        structure.append(struct.pack('>I', dtsparser.FDT_BEGIN_NODE) + pad(name.encode('latin-1') + b'\0'))
+        for prop, value in node.props.items():
+            if not prop in stringoffs:
+                stringoffs[prop] = sum([len(string) for string in strings])
+                strings.append(prop.encode('latin-1') + b'\0')
+            data = dtb_propdata(value)
+            structure.append(struct.pack('>3I', dtsparser.FDT_PROP, len(data), stringoffs[prop]) + pad(data))
+        for subnode in node.subnodes:
+            add_node(subnode)
+        structure.append(struct.pack('>I', dtsparser.FDT_END_NODE))
+
+    add_node(rootnode)
+    structure.append(struct.pack('>I', dtsparser.FDT_END))
+    structure = b''.join(structure)
+    strings = b''.join(strings)
+    off_mem_rsvmap = 40
+    off_dt_struct = off_mem_rsvmap + 16
+    off_dt_strings = off_dt_struct + len(structure)
+    totalsize = off_dt_strings + len(strings)
+    header = struct.pack('>10I', dtsparser.FDT_MAGIC, totalsize, off_dt_struct, off_dt_strings, off_mem_rsvmap,
+                         17, 16, 0, len(strings), len(structure))
+    return header + b'\0' * 16 + structure + strings
 
 
 class NodeTest(unittest.TestCase):
@@ -88,6 +152,35 @@ class NodeTest(unittest.TestCase):
         with self.assertRaises(KeyError):
             self.assertEqual(node.props['reusableaaa'], '')
 
+    def test_value(self):
+        node = dtsparser.Node()
+        node.addstatement('reusable;')
+        node.addstatement('reg = <0x0 0x90000000>, <0x10>;')
+        node.addstatement('compatible = "qcom,msm8940-mtp", "qcom,\\"msm\\"\\n";')
+        node.addstatement('local-mac-address = [00 0a 35 ff];')
+        node.addstatement('mixed = "str", <0x1>;')
+        node.addstatement('gpios = <&tlmm 0x5 0x0>;')
+        node.addstatement('empty = <>;')
+        self.assertEqual(node.value('reusable'), True)
+        self.assertEqual(node.value('reg'), (0x0, 0x90000000, 0x10))
+        self.assertEqual(node.cells('reg'), (0x0, 0x90000000, 0x10))
+        self.assertEqual(node.strings('reg'), ())
+        self.assertEqual(node.value('compatible'), ('qcom,msm8940-mtp', 'qcom,"msm"\n'))
+        self.assertEqual(node.strings('compatible'), ('qcom,msm8940-mtp', 'qcom,"msm"\n'))
+        self.assertEqual(node.cells('compatible'), ())
+        self.assertEqual(node.value('local-mac-address'), b'\x00\x0a\x35\xff')
+        self.assertEqual(node.value('mixed'), ('str', (1,)))
+        self.assertEqual(node.strings('mixed'), ())
+        self.assertEqual(node.value('gpios'), ('&tlmm', 5, 0))
+        self.assertEqual(node.cells('gpios'), ())
+        self.assertEqual(node.cells('empty'), ())
+        self.assertEqual(node.cells('nonexist'), ())
+        with self.assertRaises(KeyError):
+            node.value('nonexist')
+        self.assertTrue(node.value('reg') is node.value('reg'))
+        node.addstatement('reg = <0x5>;')
+        self.assertEqual(node.cells('reg'), (5,))
+
     def test_isDisabled(self):
         node = dtsparser.Node()
         node.addstatement('compatible = "shared-dma-pool";')
@@ -137,6 +230,32 @@ class NodeTest(unittest.TestCase):
         self.assertEqual(node21.subnodes, [])
         self.assertEqual(node31.subnodes, [])
 
+    def test_iter_nodes(self):
+        root = dtsparser.Node()
+        root.name = '/'
+        nodes = dict()
+        for name, parent in [('a', '/'), ('a1', 'a'), ('a11', 'a1'), ('a2', 'a'), ('b', '/'), ('b1', 'b'), ('c', '/')]:
+            nodes[name] = dtsparser.Node()
+            nodes[name].name = name
+            nodes.get(parent, root).addsubnode(nodes[name])
+        nodes['a1'].addstatement('status = "disabled";')
+        nodes['b1'].addstatement('reg = <0x1>;')
+        self.assertEqual([node.name for node in dtsparser.iter_nodes(root)], ['/', 'a', 'a1', 'a11', 'a2', 'b', 'b1', 'c'])
+        self.assertEqual([node.name for node in dtsparser.iter_nodes(nodes['a'])], ['a', 'a1', 'a11', 'a2'])
+        self.assertEqual([node.name for node in dtsparser.iter_nodes(root, prune=dtsparser.Node.isDisabled)],
+                         ['/', 'a', 'a2', 'b', 'b1', 'c'])
+        self.assertEqual(list(dtsparser.iter_nodes(nodes['a1'], prune=dtsparser.Node.isDisabled)), [])
+        self.assertEqual(list(dtsparser.iter_props(root)), [(nodes['a1'], 'status', '"disabled"'), (nodes['b1'], 'reg', '<0x1>')])
+        self.assertEqual(list(dtsparser.iter_props(root, prune=dtsparser.Node.isDisabled)), [(nodes['b1'], 'reg', '<0x1>')])
+
+        node = root
+        for i in range(5000):
+            subnode = dtsparser.Node()
+            subnode.name = 'deep{}'.format(i)
+            node.addsubnode(subnode)
+            node = subnode
+        self.assertEqual(len(list(dtsparser.iter_nodes(root))), 8 + 5000)
+
     def test_dump(self):
         node = dtsparser.Node()
         with self.assertRaises(ValueError):
@@ -199,6 +318,385 @@ class DtsTest(unittest.TestCase):
             filecontents_header =  filecontents[:re.search(re.compile('/ {'), filecontents).span()[0]]
             self.assertEqual(filecontents, filecontents_header+dts.dump())
 
+    def test_dtb(self):
+        for file in [self.__qualcomm_dts_file, self.__mtk_dts_file, self.__sprd_dts_file, 'msm8940-mtp.dts']:
+            dts = dtsparser.Dts(file, with_disabled_node=True)
+            fd, dtbfile = tempfile.mkstemp(suffix='.dtb')
+            with os.fdopen(fd, 'wb') as tfd:
+                tfd.write(make_dtb(dts.find_node_by_patternname('/')[0]))
+            try:
+                dtb = dtsparser.Dts(dtbfile, with_disabled_node=True)
+                self.assertEqual(dtb.dump(), dts.dump())
+                self.assertEqual(dtb.get_platform(), dts.get_platform())
+                dtb = dtsparser.Dts(dtbfile)
+                self.assertEqual(dtb.dump(), dtsparser.Dts(file).dump())
+                self.assertEqual(dtb.find_node_by_phandle('0x45').name, dtsparser.Dts(file).find_node_by_phandle('0x45').name)
+            finally:
+                os.unlink(dtbfile)
+
+        fd, dtbfile = tempfile.mkstemp(suffix='.dtb')
+        with os.fdopen(fd, 'wb') as tfd:
+            tfd.write(struct.pack('>I', dtsparser.FDT_MAGIC) + b'\0' * 8)
+        try:
+            with self.assertRaises(ValueError):
+                dtsparser.Dts(dtbfile)
+        finally:
+            os.unlink(dtbfile)
+
+    def test_dts_syntax(self):
+        source = '/dts-v1/;\n/memreserve/ 0x0 0x1000;\n/* comment { */\n' \
+                 '/ { compatible = "qcom,test"; model = "a;b {c}", "\\"d\\"";\n' \
+                 '\t// comment };\n\tlabel: node@0 { reg = <0x0\n\t\t0x1000>; phandle = <0x1>; empty; };\n' \
+                 '\tdisabled { status = "disabled"; phandle = <0x2>; sub { }; };\n};\n'
+        fd, dtsfile = tempfile.mkstemp(suffix='.dts')
+        with os.fdopen(fd, 'w') as tfd:
+            tfd.write(source)
+        try:
+            dts = dtsparser.Dts(dtsfile, with_disabled_node=True)
+            root = dts.find_node_by_patternname('/')[0]
+            self.assertEqual(root.props, {'compatible': '"qcom,test"', 'model': '"a;b {c}", "\\"d\\""'})
+            self.assertEqual([node.name for node in root.subnodes], ['node@0', 'disabled'])
+            node = dts.find_node_by_phandle('0x1')
+            self.assertEqual(node.props, {'reg': '<0x0\n\t\t0x1000>', 'phandle': '<0x1>', 'empty': ''})
+            self.assertEqual(dts.find_node_by_phandle('0x2').subnodes[0].name, 'sub')
+            dts = dtsparser.Dts(dtsfile)
+            root = dts.find_node_by_patternname('/')[0]
+            self.assertEqual([node.name for node in dts.subnodes(root)], ['node@0'])
+            self.assertEqual([node.name for node in dts.view(True).subnodes(root)], ['node@0', 'disabled'])
+            self.assertEqual([node.name for node in root.subnodes], ['node@0', 'disabled'])
+            self.assertEqual(dts.find_node_by_phandle('0x2'), None)
+            chunk_size = dtsparser.DTS_CHUNK_SIZE
+            try:
+                for dtsparser.DTS_CHUNK_SIZE in [chunk_size, 1, 20]:
+                    for stream in [io.StringIO(source), source.splitlines(True), iter(source)]:
+                        self.assertEqual(dtsparser.Dts(stream, with_disabled_node=True).dump(),
+                                         dtsparser.Dts(dtsfile, with_disabled_node=True).dump())
+                    with self.assertRaisesRegex(ValueError, 'line 4'):
+                        dtsparser.Dts(io.StringIO('/ {\n\ta = <0x1>;\n};\n};\n'))
+                    for stream in [io.BytesIO(source.encode()), [source.encode()]]:
+                        self.assertRaises(TypeError, dtsparser.Dts, stream)
+            finally:
+                dtsparser.DTS_CHUNK_SIZE = chunk_size
+            for error in ['/ { a = <0x1>;\n', '/ { a = <0x1>; };\n};\n', '/ { };\n/ { };\nnode { };\n']:
+                with open(dtsfile, 'w') as tfd:
+                    tfd.write(error)
+                with self.assertRaises(ValueError):
+                    dtsparser.Dts(dtsfile)
+        finally:
+            os.unlink(dtsfile)
+
+    def test_parse_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = dtsparser.ParseCache(tmpdir)
+            dts = dtsparser.Dts(self.__qualcomm_dts_file, cache=cache)
+            entries = os.listdir(tmpdir)
+            self.assertEqual(len(entries), 1)
+            cached = dtsparser.Dts(self.__qualcomm_dts_file, cache=cache)
+            self.assertEqual(os.listdir(tmpdir), entries)
+            self.assertEqual(cached.dump(), dts.dump())
+            self.assertEqual(cached.find_node_by_phandle('0x45').name, 'llcc-bw-opp-table')
+            self.assertEqual(cached.find_node_by_phandle('0x45').parent.subnodes.count(cached.find_node_by_phandle('0x45')), 1)
+            self.assertEqual(len(cached.find_node_statement_by_statementpattern('gpio-controller')),
+                             len(dts.find_node_statement_by_statementpattern('gpio-controller')))
+            self.assertEqual(cached.dump_gpio_interrupt_pinctrl_usage(), dts.dump_gpio_interrupt_pinctrl_usage())
+
+            full = dtsparser.Dts(self.__qualcomm_dts_file, with_disabled_node=True, cache=cache)
+            self.assertEqual(os.listdir(tmpdir), entries)
+            self.assertNotIn('parse', full.stats.phases)
+            self.assertEqual(dtsparser.Dts(self.__qualcomm_dts_file, with_disabled_node=True, cache=cache).dump(), full.dump())
+
+            for entry in os.listdir(tmpdir):
+                with open(os.path.join(tmpdir, entry), 'wb') as fd:
+                    fd.write(b'broken')
+            self.assertEqual(dtsparser.Dts(self.__qualcomm_dts_file, cache=cache).dump(), dts.dump())
+
+            cache.max_size = 1
+            dtsparser.Dts(self.__mtk_dts_file, cache=cache)
+            self.assertEqual(len(os.listdir(tmpdir)), 0)
+            cache.max_size = 1024 * 1024 * 1024
+            dtsparser.Dts(self.__mtk_dts_file, cache=cache)
+            dtsparser.Dts(self.__sprd_dts_file, cache=cache)
+            mtk_entry = cache.key(self.__mtk_dts_file) + '.cache'
+            sprd_entry = cache.key(self.__sprd_dts_file) + '.cache'
+            os.utime(os.path.join(tmpdir, mtk_entry), (0, 0))
+            dtsparser.Dts(self.__mtk_dts_file, cache=cache)
+            cache.max_size = os.path.getsize(os.path.join(tmpdir, mtk_entry))
+            cache.evict()
+            self.assertEqual(os.listdir(tmpdir), [mtk_entry])
+            self.assertNotEqual(cache.key(self.__mtk_dts_file), cache.key(self.__sprd_dts_file))
+            cache.clear()
+            self.assertEqual(os.listdir(tmpdir), [])
+
+            deep = '/ {\n' + 'a {\n' * 400 + '};\n' * 400 + '};\n'
+            deep_file = os.path.join(tmpdir, 'deep.dts')
+            with open(deep_file, 'w') as fd:
+                fd.write(deep)
+            self.assertEqual(dtsparser.Dts(deep_file, cache=cache).dump(), dtsparser.Dts(deep_file).dump())
+            self.assertEqual([entry for entry in os.listdir(tmpdir) if entry != 'deep.dts'], [])
+
+            private = os.path.join(tmpdir, 'private', 'cache')
+            cache = dtsparser.ParseCache(private)
+            self.assertTrue(cache.store('key', 1))
+            self.assertEqual(os.stat(private).st_mode & 0o777, 0o700)
+            os.chmod(private, 0o777)
+            self.assertEqual(cache.load('key'), None)
+            self.assertFalse(cache.store('key', 1))
+            os.chmod(private, 0o700)
+            self.assertEqual(cache.load('key'), 1)
+
+    def test_lazy_dts(self):
+        for with_disabled_node in [False, True]:
+            dts = dtsparser.Dts(self.__sprd_dts_file, with_disabled_node=with_disabled_node)
+            with dtsparser.LazyDts(self.__sprd_dts_file, with_disabled_node=with_disabled_node) as lazy:
+                self.assertEqual(lazy.get_platform(), dtsparser.Platform.SPRD)
+                node = lazy.find_node_by_phandle('0x4f')
+                self.assertTrue(isinstance(node, dtsparser.LazyNode))
+                self.assertEqual(node.props, dts.find_node_by_phandle('0x4f').props)
+                self.assertEqual(node.parent.name, dts.find_node_by_phandle('0x4f').parent.name)
+                for phandle in range(1, 0x200):
+                    expected = dts.find_node_by_phandle(phandle)
+                    self.assertEqual(lazy.find_node_by_phandle(phandle) and lazy.find_node_by_phandle(phandle).dump(),
+                                     expected and expected.dump())
+                self.assertEqual(lazy.dump(), dts.dump())
+
+        source = '/dts-v1/;\n/ {\n\tcompatible = "qcom,test";\n\tmodel = "a { b", "};";  // c {\n' \
+                 '\tnode@0 { reg = <0x0>; vendor,status = "disabled"; phandle = <0x1>; };\n\tdisabled {\n\t\tstatus = "disabled";\n' \
+                 '\t\tsub {\n\t\t\tlinux,phandle = <0x2>;\n\t\t};\n\t};\n\tother-phandle = <0x3>;\n};\n'
+        fd, dtsfile = tempfile.mkstemp(suffix='.dts')
+        with os.fdopen(fd, 'w') as tfd:
+            tfd.write(source)
+        try:
+            with dtsparser.LazyDts(dtsfile, with_disabled_node=True) as lazy:
+                self.assertEqual(lazy.dump(), dtsparser.Dts(dtsfile, with_disabled_node=True).dump())
+                self.assertEqual(lazy.find_node_by_phandle(2).name, 'sub')
+                self.assertEqual(lazy.find_node_by_phandle(3), None)
+            with dtsparser.LazyDts(dtsfile) as lazy:
+                self.assertEqual(lazy.find_node_by_phandle('<0x1>').props, {'reg': '<0x0>', 'vendor,status': '"disabled"', 'phandle': '<0x1>'})
+                self.assertEqual(lazy.find_node_by_phandle(2), None)
+                self.assertEqual(lazy.find_node_by_phandle('01').name, 'node@0')
+                self.assertEqual(lazy.dump(), dtsparser.Dts(dtsfile).dump())
+            for error in ['/ { a = <0x1>;\n', '/ { };\n};\n', '/ { };\n&label { };\n', '/ { a = <0x1> };\n']:
+                with open(dtsfile, 'w') as tfd:
+                    tfd.write(error)
+                with self.assertRaises(ValueError):
+                    with dtsparser.LazyDts(dtsfile) as lazy:
+                        lazy.dump()
+        finally:
+            os.unlink(dtsfile)
+
+    def test_apply_overlay(self):
+        overlay_dts = '''/dts-v1/;
+
+/ {
+	fragment@0 {
+		target = <0xffffffff>;
+		__overlay__ {
+			clock-frequency = <0x61a80>;
+			touch@38 {
+				compatible = "vendor,touch";
+				reg = <0x38>;
+				interrupt-parent = <0xffffffff>;
+				interrupts = <0x7a 0x2>;
+				pinctrl-names = "default";
+				pinctrl-0 = <0x1>;
+				phandle = <0x2>;
+			};
+			unused@1 {
+				status = "disabled";
+			};
+		};
+	};
+	fragment@1 {
+		target-path = "/soc/pinctrl@03000000";
+		__overlay__ {
+			touch_pins {
+				phandle = <0x1>;
+				config {
+					pins = "gpio122";
+					bias-pull-up;
+				};
+			};
+		};
+	};
+	__symbols__ {
+		touch = "/fragment@0/__overlay__/touch@38";
+		touch_pins = "/fragment@1/__overlay__/touch_pins";
+	};
+	__fixups__ {
+		qupv3_se4_i2c = "/fragment@0:target:0";
+		tlmm = "/fragment@0/__overlay__/touch@38:interrupt-parent:0";
+	};
+	__local_fixups__ {
+		fragment@0 {
+			__overlay__ {
+				touch@38 {
+					pinctrl-0 = <0x0>;
+				};
+			};
+		};
+	};
+};
+'''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            overlay_file = os.path.join(tmpdir, 'overlay.dts')
+            with open(overlay_file, 'w') as fd:
+                fd.write(overlay_dts)
+            overlay = dtsparser.Dts(overlay_file, with_disabled_node=True)
+            dtbo_file = os.path.join(tmpdir, 'overlay.dtbo')
+            with open(dtbo_file, 'wb') as fd:
+                fd.write(make_dtb(overlay.node('/')))
+            overlay_dump = overlay.dump()
+
+            dts = dtsparser.Dts(self.__qualcomm_dts_file, with_disabled_node=True)
+            last = max([node.cells('phandle')[0] for node in dts.iter_nodes() if node.cells('phandle')])
+            dts.apply_overlay(overlay)
+            self.assertEqual(overlay.dump(), overlay_dump)
+            i2c = dts.node('/soc/i2c@890000')
+            touch = dts.node('/soc/i2c@890000/touch@38')
+            self.assertEqual(i2c.cells('clock-frequency'), (400000,))
+            self.assertEqual([node.name for node in i2c.subnodes][-2:], ['touch@38', 'unused@1'])
+            self.assertEqual(touch.cells('phandle'), (last + 2,))
+            self.assertTrue(dts.find_node_by_phandle(last + 2) is touch)
+            self.assertTrue(dts.find_node_by_phandle(last + 1) is dts.node('/soc/pinctrl@03000000/touch_pins'))
+            self.assertEqual(touch.cells('pinctrl-0'), (last + 1,))
+            self.assertEqual(touch.cells('interrupt-parent'), dts.label('tlmm').cells('phandle'))
+            self.assertTrue(dts.label('touch') is touch)
+            self.assertEqual(dts.path(dts.label('touch_pins')), '/soc/pinctrl@03000000/touch_pins')
+            self.assertEqual(dts.select('**[compatible="vendor,touch"]'), [touch])
+            tlmm_usage = dts.get_gpio_interrupt_pinctrl_usage()[dts.label('tlmm')]
+            self.assertTrue('touch@38' in tlmm_usage[1][0x7a])
+            self.assertTrue((touch, dts.node('/soc/pinctrl@03000000/touch_pins')) in tlmm_usage[2][122])
+
+            dts_without_disabled = dtsparser.Dts(self.__qualcomm_dts_file)
+            dts_without_disabled.apply_overlay(dtbo_file)
+            self.assertEqual(dts_without_disabled.node('/soc/i2c@890000/unused@1'), None)
+            touch = dts_without_disabled.node('/soc/i2c@890000/touch@38')
+            self.assertEqual(touch.props['interrupts'], '<0x7a 0x2>')
+            self.assertTrue(dts_without_disabled.find_node_by_phandle(touch.cells('pinctrl-0')[0])
+                            is dts_without_disabled.label('touch_pins'))
+            self.assertEqual(dts_without_disabled.stats.phases['apply_overlay']['calls'], 1)
+
+            dts = dtsparser.Dts(self.__qualcomm_dts_file, with_disabled_node=True)
+            with open(overlay_file, 'w') as fd:
+                fd.write(overlay_dts.replace('tlmm =', 'nonexist ='))
+            self.assertRaises(ValueError, dts.apply_overlay, overlay_file)
+            with open(overlay_file, 'w') as fd:
+                fd.write(overlay_dts.replace('"/soc/', '"/nonexist/'))
+            base_dump = dts.dump()
+            self.assertRaises(ValueError, dts.apply_overlay, overlay_file)
+            self.assertEqual(dts.dump(), base_dump)
+
+        base = '/ {\n\tsoc {\n\t\ti2c@1 {\n\t\t};\n\t};\n\t__symbols__ {\n\t\ti2c = "/soc/i2c@1";\n\t};\n};\n'
+        overlay = '/ {\n\tfragment@0 {\n\t\ttarget = <0xffffffff>;\n\t\t__overlay__ {\n\t\t\ttouch {\n' \
+                  '\t\t\t\tcompatible = "x";\n\t\t\t\tphandle = <0x1>;\n\t\t\t};\n\t\t};\n\t};\n' \
+                  '\tfragment@1 {\n\t\ttarget-path = "/nonexist";\n\t\t__overlay__ {\n\t\t};\n\t};\n' \
+                  '\t__fixups__ {\n\t\ti2c = "/fragment@0:target:0";\n\t};\n};\n'
+        dts = dtsparser.Dts(io.StringIO(base))
+        base_dump = dts.dump()
+        self.assertRaises(ValueError, dts.apply_overlay, dtsparser.Dts(io.StringIO(overlay), with_disabled_node=True))
+        self.assertEqual(dts.dump(), base_dump)
+        self.assertEqual(dts.node('/soc/i2c@1').props, {})
+        self.assertEqual(dts.select('**[compatible="x"]'), [])
+        dts.apply_overlay(dtsparser.Dts(io.StringIO(overlay.replace('/nonexist', '/soc')), with_disabled_node=True))
+        touch = dts.node('/soc/i2c@1/touch')
+        self.assertEqual(dts.select('**[compatible="x"]'), [touch])
+        self.assertTrue(dts.find_node_by_phandle(1) is touch)
+        self.assertTrue(dts.find_node_by_phandle(2) is dts.node('/soc/i2c@1'))
+
+    def test_diff(self):
+        dts = dtsparser.Dts(self.__qualcomm_dts_file)
+        self.assertEqual(dts.diff(dtsparser.Dts(self.__qualcomm_dts_file)), [])
+        self.assertEqual(len(dts.diff(dtsparser.Dts(self.__qualcomm_dts_file, with_disabled_node=True))),
+                         len([node for node in dtsparser.Dts(self.__qualcomm_dts_file, with_disabled_node=True).iter_nodes(
+                             prune=lambda node: node.parent and node.parent.isDisabled()) if node.isDisabled()]))
+
+        old = '/ {\n\tcompatible = "qcom,test";\n\tsoc {\n\t\tpinctrl@1000 {\n\t\t\tgpio-controller;\n' \
+              '\t\t\t#gpio-cells = <0x2>;\n\t\t\tphandle = <0x1>;\n\t\t};\n\t\tdev@1 {\n\t\t\treset-gpios = <0x1 0x5 0x0>;\n' \
+              '\t\t\tpinctrl-0 = <0x1>;\n\t\t\treg = <0x1>;\n\t\t\tstatus = "okay";\n\t\t};\n\t\tgone {\n\t\t};\n\t};\n};\n'
+        new = old.replace('<0x1>;\n\t\t};', '<0x7>;\n\t\t};').replace('<0x1 0x5', '<0x7 0x5').replace('-0 = <0x1>', '-0 = <0x7>')
+        self.assertEqual(dtsparser.Dts(io.StringIO(old)).diff(dtsparser.Dts(io.StringIO(new))), [])
+        new = new.replace('0x5', '0x6').replace('"okay"', '"ok"').replace('\t\t\treg = <0x1>;\n', '').replace('gone', 'new')
+        new = new.replace('dev@1 {\n', 'dev@1 {\n\t\t\tvdd-supply = <0x7>;\n')
+        dts = dtsparser.Dts(io.StringIO(old))
+        changes = dts.diff(dtsparser.Dts(io.StringIO(new)))
+        self.assertEqual([change[:3] for change in changes], [
+            ('changed', '/soc/dev@1', 'reset-gpios'), ('removed', '/soc/dev@1', 'reg'), ('changed', '/soc/dev@1', 'status'),
+            ('added', '/soc/dev@1', 'vdd-supply'), ('removed', '/soc/gone', None), ('added', '/soc/new', None)])
+        self.assertEqual(changes[0][3:], ('<&/soc/pinctrl@1000 0x5 0x0>', '<&/soc/pinctrl@1000 0x6 0x0>'))
+        self.assertEqual(changes[1][3:], ('<0x1>', None))
+        self.assertEqual(changes[3][3:], (None, '<&/soc/pinctrl@1000>'))
+        self.assertEqual(changes[4][3].name, 'gone')
+        self.assertEqual(dtsparser.node_path(changes[5][4]), '/soc/new')
+
+    def test_node_store(self):
+        store = dtsparser.NodeStore()
+        dts = dtsparser.Dts(self.__qualcomm_dts_file)
+        shared = [dtsparser.Dts(self.__qualcomm_dts_file, store=store) for i in range(2)]
+        nodes = len(list(dts.view(True).iter_nodes()))
+        self.assertEqual((store.nodes, store.props), (2 * nodes, len(set([tuple(node.props.items()) for node in dts.view(True).iter_nodes()]))))
+        self.assertEqual(shared[0].dump(), dts.dump())
+        self.assertEqual(store.share(dts.find_node_by_patternname('/')[0]), nodes)
+        node0, node1 = shared[0].node('/cpus/cpu@0'), shared[1].node('/cpus/cpu@0')
+        self.assertTrue(node0.props is node1.props)
+        self.assertEqual(node1.cells('reg'), (0, 0))
+        node0.addprop('reg', '<0x0 0x1>')
+        self.assertEqual(node0.cells('reg'), (0, 1))
+        self.assertEqual(node1.cells('reg'), (0, 0))
+        self.assertEqual(node1.props['reg'], '<0x0 0x0>')
+        self.assertEqual(shared[1].dump(), dts.dump())
+        self.assertTrue(shared[0].node('/cpus').props is shared[1].node('/cpus').props)
+        self.assertEqual(shared[0].stats.phases['share']['nodes'], len(list(dts.iter_nodes())))
+
+    def test_views(self):
+        dts = dtsparser.Dts(self.__qualcomm_dts_file)
+        full = dts.view(True)
+        self.assertTrue(dts.view(False) is dts)
+        self.assertTrue(full.view(True) is full)
+        self.assertTrue(full.view(False) is dts)
+        for with_disabled_node, view in ((False, dts), (True, full)):
+            parsed = dtsparser.Dts(self.__qualcomm_dts_file, with_disabled_node=with_disabled_node)
+            self.assertEqual(view.dump(), parsed.dump())
+            self.assertEqual([view.path(node) for node in view.iter_nodes()], [parsed.path(node) for node in parsed.iter_nodes()])
+            self.assertEqual(sorted(view.get_gpiocontroller_node_phandle().values()),
+                             sorted(parsed.get_gpiocontroller_node_phandle().values()))
+            self.assertEqual(view.dump_gpio_interrupt_pinctrl_usage(), parsed.dump_gpio_interrupt_pinctrl_usage())
+        pinctrl = full.node('/soc/slpi_pinctrl@02B40000')
+        self.assertTrue(pinctrl.isDisabled())
+        self.assertFalse(pinctrl.subnodes[0].isDisabled())
+        self.assertTrue(dts.is_disabled(pinctrl.subnodes[0]))
+        self.assertFalse(dts.is_disabled(full.node('/cpus')))
+        self.assertIsNone(dts.node('/soc/slpi_pinctrl@02B40000'))
+        self.assertFalse(pinctrl in list(dts.iter_nodes()))
+        self.assertTrue(full.find_node_by_phandle(pinctrl.subnodes[0].props['phandle'][1:-1]) is pinctrl.subnodes[0])
+        self.assertIn(pinctrl, full.node('/soc').subnodes)
+        self.assertIn(pinctrl, full.subnodes(full.node('/soc')))
+        self.assertNotIn(pinctrl, dts.subnodes(dts.node('/soc')))
+
+    def test_stats(self):
+        stats = dtsparser.Stats()
+        dts = dtsparser.Dts(self.__mtk_dts_file, stats=stats)
+        self.assertTrue(dts.stats is stats)
+        nodes = len(list(dts.iter_nodes()))
+        props = len(list(dts.iter_props()))
+        self.assertEqual(list(stats.phases), ['parse', 'index'])
+        self.assertEqual(stats.phases['parse']['nodes'], nodes)
+        self.assertEqual(stats.phases['parse']['props'], props)
+        dts.dump_gpio_interrupt_pinctrl_usage()
+        dts.dump_gpio_interrupt_pinctrl_usage()
+        self.assertEqual(stats.phases['dump_gpio_interrupt_pinctrl_usage']['calls'], 2)
+        self.assertEqual(stats.phases['get_gpio_interrupt_pinctrl_usage']['nodes'], 2 * nodes)
+        self.assertGreaterEqual(stats.seconds('dump_gpio_interrupt_pinctrl_usage'),
+                                stats.seconds('get_gpio_interrupt_pinctrl_usage'))
+        self.assertEqual(stats.seconds('nonexist'), 0.0)
+        total = dtsparser.Stats()
+        total.merge(stats)
+        total.merge(dtsparser.Dts(self.__mtk_dts_file).stats)
+        self.assertEqual(total.phases['parse']['calls'], 2)
+        self.assertEqual(total.phases['parse']['nodes'], 2 * nodes)
+        report = total.report().splitlines()
+        self.assertEqual(report[0].split(), ['phase', 'seconds', 'calls', 'nodes', 'props'])
+        self.assertEqual(report[1].split()[0], 'parse')
+
     def test_get_platform(self):
         dts = dtsparser.Dts(self.__qualcomm_dts_file)
         self.assertEqual(dts.get_platform(), dtsparser.Platform.QUALCOMM)
@@ -241,6 +739,69 @@ class DtsTest(unittest.TestCase):
         self.assertTrue(isinstance(nodes, list))
         self.assertEqual(nodes, [])
 
+        cpus = dts.node('/cpus')
+        self.assertEqual([node.name for node in dts.find_node_by_patternname('cpu@.*', subtree=cpus)],
+                         ['cpu@0', 'cpu@100', 'cpu@200', 'cpu@300', 'cpu@400', 'cpu@500', 'cpu@600', 'cpu@700'])
+        self.assertEqual(dts.find_node_by_patternname('l2-cache', subtree='/cpus/cpu@100'), [dts.node('/cpus/cpu@100/l2-cache')])
+        self.assertEqual(dts.find_node_by_patternname('.*', subtree='/nonexist'), [])
+        for pattern, subtree, unit_address in [('.*', None, '1'), ('.*', None, 'A'), ('cpu@.*', '/cpus', '1'), ('.*', '/soc', '88')]:
+            self.assertEqual(dts.find_node_by_patternname(pattern, subtree, unit_address),
+                             [node for node in dts.find_node_by_patternname(pattern, subtree)
+                              if node.name.partition('@')[2].lower().startswith(unit_address.lower())])
+        dts = dtsparser.Dts(self.__qualcomm_dts_file)
+        pinctrl = dts.view(True).node('/soc/slpi_pinctrl@02B40000')
+        self.assertTrue(dts.view(True).find_node_by_patternname('.*', pinctrl, '0'))
+        self.assertEqual(dts.find_node_by_patternname('.*', pinctrl), [])
+        self.assertEqual(dts.find_node_by_patternname('.*', pinctrl, '0'), [])
+
+    def test_node_label(self):
+        dts = dtsparser.Dts(self.__qualcomm_dts_file)
+        self.assertEqual(dts.node('/').name, '/')
+        self.assertEqual(dts.node('/cpus/cpu@0/l2-cache/').name, 'l2-cache')
+        self.assertEqual(dts.path(dts.node('/cpus/cpu@0/l2-cache')), '/cpus/cpu@0/l2-cache')
+        self.assertEqual(dts.node('/cpus/cpu@0/nonexist'), None)
+        self.assertTrue(dts.label('CPU0') is dts.node('/cpus/cpu@0'))
+        self.assertTrue(dts.node('L2_0/l3-cache') is dts.label('L3_0'))
+        self.assertEqual(dts.node('nonexist/l3-cache'), None)
+        self.assertEqual(dts.label('nonexist'), None)
+        for node in dts.iter_nodes():
+            self.assertTrue(dts.node(dts.path(node)) is node)
+            self.assertEqual(dts.path(node), dtsparser.node_path(node))
+        dts = dtsparser.Dts('msm8940-mtp.dts')
+        self.assertEqual(dts.path(dts.label('smd1')), '/soc/qcom,smdtty/qcom,smdtty-apps-fm')
+
+    def test_select(self):
+        dts = dtsparser.Dts(self.__qualcomm_dts_file)
+        nodes = list(dts.iter_nodes())
+        expect = [node for node in nodes if node.parent and node.parent.parent and node.parent.name == 'soc'
+                  and node.parent.parent.name == '/' and re.search('qcom,.*i2c', node.props.get('compatible', ''))
+                  and node.props.get('status') != '"disabled"']
+        self.assertTrue(expect)
+        self.assertEqual(dts.select('soc/*[compatible~="qcom,.*i2c"][status!="disabled"]'), expect)
+        self.assertEqual(dts.select('*'), dts.subnodes(dts.node('/')))
+        self.assertEqual(dts.select('*/*'), [node for node in nodes if node.parent and node.parent.parent
+                                             and node.parent.parent.name == '/'])
+        pinctrl = []
+        for node in expect:
+            pinctrl += [dts.find_node_by_phandle(phandle) for phandle in node.cells('pinctrl-0')]
+        self.assertEqual(dts.select('soc/*[compatible~="qcom,.*i2c"][status!="disabled"] @pinctrl-0'),
+                         list(dict.fromkeys(pinctrl)))
+        self.assertEqual(dts.select('**[gpio-controller]'), [node for node in nodes if 'gpio-controller' in node.props])
+        self.assertEqual(dts.select('/**/*[!compatible][!phandle]'),
+                         [node for node in nodes if node.parent and not 'compatible' in node.props
+                          and not 'phandle' in node.props])
+        self.assertEqual(dts.select('cpus/cpu@?'), [node for node in dts.node('/cpus').subnodes if len(node.name) == 5])
+        self.assertEqual(dts.select('/cpus/cpu@0/l2-cache'), [dts.node('/cpus/cpu@0/l2-cache')])
+        self.assertEqual(dts.select('/cpus/nonexist'), [])
+        self.assertEqual(dts.select('**[phandle=<0x1>]'), [dts.find_node_by_phandle(1)])
+        self.assertEqual(dts.select('cpus/*[reg=<0x0 0x100>]'), [dts.node('/cpus/cpu@100')])
+        self.assertEqual(dts.select('cpus/*[device_type="cpu"]'), dts.select('cpus/cpu@*'))
+        self.assertEqual(dts.select('/'), [dts.node('/')])
+        for selector in ['soc[status]/*', 'soc/[', 'soc/*[status', '**[!status="okay"]', 'cpus/*[reg=<x>]']:
+            self.assertRaises(ValueError, dts.select, selector)
+        self.assertRaisesRegex(ValueError, 'regular expression', dts.select, '*[compatible~="("]')
+        self.assertRaisesRegex(ValueError, 'empty step', dts.select, 'soc//x')
+
     def test_find_node_by_phandle(self):
         dts = dtsparser.Dts('sm8150-dtb-sm8150-sdx50m-mtp-overlay.dts')
         node = dts.find_node_by_phandle('0x45')
@@ -249,6 +810,45 @@ class DtsTest(unittest.TestCase):
         self.assertEqual(node.name, 'qcom,gdsc@0xab00814')
         node = dts.find_node_by_phandle('0x943')
         self.assertEqual(node, None)
+        self.assertEqual(dts.find_node_by_phandle('<0x45>').name, 'llcc-bw-opp-table')
+        self.assertEqual(dts.find_node_by_phandle(0x84).name, 'qcom,gdsc@0xab00814')
+        self.assertTrue(dts.find_node_by_phandle('069') is dts.find_node_by_phandle(69))
+        self.assertEqual(dts.find_node_by_phandle('<010>'), dts.find_node_by_phandle(10))
+
+        dts = dtsparser.Dts(self.__mtk_dts_file)
+        self.assertEqual(dts.find_node_by_phandle('0x4e').name, 'chosen')
+
+    def test_find_node_by_phandle_recursive(self):
+        dts = dtsparser.Dts(self.__qualcomm_dts_file)
+        node = dts.find_node_by_phandle('0x45')
+        self.assertEqual(dts.find_node_by_phandle_recursive(node, '0x45'), node)
+        self.assertEqual(dts.find_node_by_phandle_recursive(node.parent, '0x45'), node)
+        self.assertEqual(dts.find_node_by_phandle_recursive(dts.find_node_by_phandle('0x84'), '0x45'), None)
+        self.assertEqual(dts.find_node_by_phandle_recursive(node, '0x943'), None)
+
+    def test_find_node_by_phandle_without_disabled_node(self):
+        dts = dtsparser.Dts(self.__qualcomm_dts_file, with_disabled_node=True)
+        disabled = [node for node in dts.find_node_statement_by_statementpattern('status = "disabled"') if 'phandle' in node.props]
+        self.assertTrue(disabled)
+        phandles = [node.props['phandle'] for node in disabled]
+        for phandle in phandles:
+            self.assertTrue(dts.find_node_by_phandle(phandle).isDisabled())
+        dts = dtsparser.Dts(self.__qualcomm_dts_file)
+        for phandle in phandles:
+            self.assertEqual(dts.find_node_by_phandle(phandle), None)
+
+    def test_iter_nodes(self):
+        dts = dtsparser.Dts(self.__qualcomm_dts_file, with_disabled_node=True)
+        nodes = list(dts.iter_nodes())
+        self.assertEqual(nodes, dts.find_node_by_patternname('.*'))
+        self.assertEqual(nodes[0].name, '/')
+        self.assertEqual(len(list(dts.iter_nodes(prune=dtsparser.Node.isDisabled))),
+                         len(dtsparser.Dts(self.__qualcomm_dts_file).find_node_by_patternname('.*')))
+        node = next(node for node in dts.iter_nodes() if node.name.startswith('audio'))
+        self.assertEqual(node.name, 'audio_etm0')
+        node, prop, value = next(item for item in dts.iter_props() if item[1] == 'phandle')
+        self.assertEqual(node.props['phandle'], value)
+        self.assertEqual(sum([len(node.props) for node in nodes]), len(list(dts.iter_props())))
 
     def test_find_node_ancestor_with_compatible_prop(self):
         dts = dtsparser.Dts('sm8150-dtb-sm8150-sdx50m-mtp-overlay.dts')
@@ -287,6 +887,23 @@ class DtsTest(unittest.TestCase):
         self.assertTrue(isinstance(node_statements, dict))
         self.assertFalse(node_statements)
 
+    def test_find_node_statement_by_statementpattern_index(self):
+        patterns = ['interrupt-controller', 'gpio-controller', 'phandle = <0x8[01].*', '.*gpio.*', 'qcom,.*',
+                    'a|interrupt-controller', 'pinctrl-names = "default"', 'qcom,step-charging-enabl?',
+                    'pins =.*', 'pins .*', 'pinctrl-0 =.*', 'pinctrl-0=.*',
+                    re.compile('pinctrl-[0-9]+ = <( *0x[0-9a-fA-F]+ *)+>'), re.compile('COMPATIBLE.*', re.IGNORECASE)]
+        for file in [self.__qualcomm_dts_file, self.__mtk_dts_file, self.__sprd_dts_file]:
+            dts = dtsparser.Dts(file, with_disabled_node=True)
+            root = dts.find_node_by_patternname('/')[0]
+            for pattern in patterns:
+                node_statements = dts.find_node_statement_by_statementpattern(pattern)
+                node_statements_recursive = dts.find_node_statement_by_statementpattern_recursive(root, pattern)
+                self.assertEqual(node_statements, node_statements_recursive)
+                self.assertEqual(list(node_statements), list(node_statements_recursive))
+                scan = [node for node in dts.iter_nodes() if any(re.fullmatch(pattern, prop + ' = ' + value if value else prop)
+                                                                 for prop, value in node.props.items())]
+                self.assertEqual(list(node_statements), scan)
+
     def test_get_interrup_controller_node_phandle(self):
         qualcomm_nodenames = ['qcom,mdss_mdp@ae00000', 'interrupt-controller@17a00000', 'interrupt-controller@0xb220000',
                      'qcom,spmi@c440000', 'qcom,qsee_irq', 'pinctrl@03000000', 'slave-kernel', 'qcom,smp2p-ipa-1-in',
@@ -431,6 +1048,91 @@ class DtsTest(unittest.TestCase):
             msg = dts.dump_gpio_interrupt_pinctrl_usage()
             print(msg)
 
+    def test_get_gpio_interrupt_pinctrl_usage(self):
+        dts_files = [self.__qualcomm_dts_file, self.__mtk_dts_file, self.__sprd_dts_file, 'msm8940-mtp.dts']
+        for file in dts_files:
+            dts = dtsparser.Dts(file)
+            usage = dts.get_gpio_interrupt_pinctrl_usage()
+            gpiocontroller_nodes = dts.get_gpiocontroller_node_phandle()
+            pinctrl_nodes = dts.get_pinctrlnode()
+            controllers = set(gpiocontroller_nodes) | set(pinctrl_nodes) | set(dts.get_interrup_controller_node_phandle())
+            self.assertEqual(set(usage), set([node for node in controllers if 'compatible' in node.props]))
+            self.assertEqual(list(usage), [node for node in dts.iter_nodes() if node in usage])
+            for node in usage:
+                gpio_nodeinfo, interrupt_nodeinfo, pinctrl_nodeinfo = usage[node]
+                if node in gpiocontroller_nodes:
+                    self.assertEqual(gpio_nodeinfo, dts.gpio_nodename_property_used(node))
+                    self.assertEqual(interrupt_nodeinfo, dts.interruptgpio_nodename_used(node))
+                else:
+                    self.assertEqual(gpio_nodeinfo, dict())
+                    self.assertEqual(interrupt_nodeinfo, dict())
+                if node in pinctrl_nodes:
+                    expected = dts.get_pinctrl_gpio_node_info(node)
+                    self.assertEqual(set(pinctrl_nodeinfo), set(expected))
+                    for gpio in expected:
+                        key = lambda item: (id(item[0]), id(item[1]))
+                        self.assertEqual(sorted(pinctrl_nodeinfo[gpio], key=key), sorted(expected[gpio], key=key))
+                else:
+                    self.assertEqual(pinctrl_nodeinfo, dict())
+
+    def test_iter_gpio_usage_records(self):
+        for file in [self.__qualcomm_dts_file, self.__mtk_dts_file, self.__sprd_dts_file, 'msm8940-mtp.dts']:
+            dts = dtsparser.Dts(file)
+            records = list(dts.iter_gpio_usage_records())
+            self.assertTrue(records)
+            expected = set()
+            for controller, (gpio_nodeinfo, interrupt_nodeinfo, pinctrl_nodeinfo) in dts.get_gpio_interrupt_pinctrl_usage().items():
+                for gpio in gpio_nodeinfo:
+                    expected.update([(controller, gpio, 'gpio', node, prop, None) for node, prop in gpio_nodeinfo[gpio]])
+                for gpio in interrupt_nodeinfo:
+                    expected.update([(controller, gpio, 'interrupt', name) for name in interrupt_nodeinfo[gpio]])
+                for gpio in pinctrl_nodeinfo:
+                    expected.update([(controller, gpio, 'pinctrl', node, config) for node, config in pinctrl_nodeinfo[gpio]])
+            result = set()
+            for record in records:
+                self.assertEqual(list(record), dtsparser.GPIO_RECORD_FIELDS)
+                controller, consumer = dts.node(record['controller']), dts.node(record['consumer'])
+                if record['kind'] == 'gpio':
+                    result.add((controller, record['gpio'], 'gpio', consumer, record['prop'], record['config']))
+                elif record['kind'] == 'interrupt':
+                    self.assertEqual(record['prop'], 'interrupts')
+                    result.add((controller, record['gpio'], 'interrupt', consumer.name))
+                else:
+                    self.assertTrue(dts.node(record['config']).cells('phandle')[0] in consumer.cells(record['prop']))
+                    result.add((controller, record['gpio'], 'pinctrl', consumer, dts.node(record['config'])))
+            self.assertEqual(result, expected)
+            self.assertEqual(len(records), len(set([tuple(record.values()) for record in records])))
+
+            stream = io.StringIO()
+            self.assertEqual(dtsparser.write_gpio_records(stream, iter(records), 'jsonl'), len(records))
+            self.assertEqual([json.loads(line) for line in stream.getvalue().splitlines()], records)
+            stream = io.StringIO()
+            dtsparser.write_gpio_records(stream, records, 'csv')
+            rows = list(csv.DictReader(io.StringIO(stream.getvalue())))
+            self.assertEqual(len(rows), len(records))
+            self.assertEqual([row['consumer'] for row in rows], [record['consumer'] for record in records])
+            self.assertEqual(rows[-1]['gpio'], str(records[-1]['gpio']))
+        self.assertRaises(ValueError, dtsparser.write_gpio_records, io.StringIO(), records, 'xml')
+
+    def test_iter_gpio_conflict_records(self):
+        for file in [self.__qualcomm_dts_file, self.__mtk_dts_file, self.__sprd_dts_file, 'msm8940-mtp.dts']:
+            dts = dtsparser.Dts(file)
+            uses = dict()
+            for record in dts.iter_gpio_usage_records():
+                uses.setdefault((record['controller'], record['gpio']), []).append(record)
+            conflicts = []
+            for records in uses.values():
+                consumers = [record['consumer'] for record in records]
+                if not [owner for owner in consumers
+                        if not [consumer for consumer in consumers if not (consumer + '/').startswith(owner + '/')]]:
+                    conflicts += records
+            self.assertTrue(conflicts)
+            self.assertEqual(list(dts.iter_gpio_conflict_records()), conflicts)
+        dts = dtsparser.Dts(self.__qualcomm_dts_file)
+        keys = [record for record in dts.iter_gpio_usage_records() if record['consumer'].startswith('/soc/gpio_keys')]
+        self.assertEqual(set([record['consumer'] for record in keys]), {'/soc/gpio_keys', '/soc/gpio_keys/vol_up'})
+        self.assertFalse([record for record in dts.iter_gpio_conflict_records() if record['consumer'].startswith('/soc/gpio_keys')])
+
     #@unittest.skip('check output')
     def test_get_pinctrl_gpio_node_info(self):
         dts_files = [self.__qualcomm_dts_file, self.__mtk_dts_file, self.__sprd_dts_file]
@@ -490,6 +1192,204 @@ class dtsparserTest(unittest.TestCase):
     def test_dtsparser(self):
         os.system('./dtsparser.py -f sm8150-dtb-sm8150-sdx50m-mtp-overlay.dts')
 
+    def test_process_dtbs(self):
+        dts_files = ['sm8150-dtb-sm8150-sdx50m-mtp-overlay.dts', 'mt6771-dtb-k71v1_64_bsp.dts',
+                     'sp9863a-1h10-native-dtb-sp9863a-1h10-overlay.dts']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dtbs = []
+            for file in dts_files:
+                dtbs.append(os.path.join(tmpdir, file.replace('.dts', '.dtb')))
+                with open(dtbs[-1], 'wb') as fd:
+                    fd.write(make_dtb(dtsparser.Dts(file, with_disabled_node=True).find_node_by_patternname('/')[0]))
+            dtbs.insert(1, os.path.join(tmpdir, 'broken.dtb'))
+            with open(dtbs[1], 'wb') as fd:
+                fd.write(struct.pack('>I', dtsparser.FDT_MAGIC))
+
+            results = list(dtsparser.process_dtbs(dtbs, jobs=3))
+            self.assertEqual([result[0] for result in results], dtbs)
+            self.assertEqual(results[1][1], None)
+            self.assertTrue(results[1][2].startswith('ValueError'))
+            reports = []
+            for i in [0, 2, 3]:
+                dtb_file, result_file, error, output, stats = results[i]
+                self.assertEqual(error, None)
+                self.assertEqual(result_file, dtb_file.replace('.dtb', '_gpio_use.txt'))
+                self.assertTrue({'parse', 'index', 'dump_gpio_interrupt_pinctrl_usage', 'write'} <= set(stats.phases))
+                with open(result_file) as fd:
+                    reports.append(fd.read())
+                self.assertEqual(reports[-1], dtsparser.Dts(dts_files[len(reports) - 1]).dump_gpio_interrupt_pinctrl_usage())
+
+            results_sequential = list(dtsparser.process_dtbs(dtbs, jobs=1))
+            self.assertEqual([result[:4] for result in results_sequential], [result[:4] for result in results])
+
+            dtb_file, result_file, error, output, stats = dtsparser.process_dtb(dtbs[0], format='jsonl')
+            self.assertEqual(result_file, dtb_file.replace('.dtb', '_gpio_use.jsonl'))
+            with open(result_file) as fd:
+                self.assertEqual([json.loads(line) for line in fd],
+                                 list(dtsparser.Dts(dts_files[0]).iter_gpio_usage_records()))
+
+    def test_dts_server(self):
+        qualcomm_dts_file = 'sm8150-dtb-sm8150-sdx50m-mtp-overlay.dts'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dts_file = os.path.join(tmpdir, 'board.dts')
+            with open(qualcomm_dts_file) as fd:
+                text = fd.read()
+            with open(dts_file, 'w') as fd:
+                fd.write(text)
+            dts = dtsparser.Dts(qualcomm_dts_file)
+            server = dtsparser.DtsServer()
+            self.assertTrue(server.tree(dts_file) is server.tree(dts_file))
+            self.assertTrue(server.tree(dts_file, True) is server.tree(dts_file).view(True))
+            self.assertRaises(ValueError, server.serve, dts_file)
+            self.assertTrue(os.path.isfile(dts_file))
+            path = os.path.join(tmpdir, 'server.sock')
+            thread = threading.Thread(target=server.serve, args=(path,))
+            thread.start()
+            try:
+                for i in range(100):
+                    if os.path.exists(path):
+                        break
+                    time.sleep(0.05)
+                query = lambda query, arg=None: dtsparser.query_server(path, {'file': dts_file, 'query': query, 'arg': arg})
+                self.assertEqual(query('gpio_usage'), json.loads(json.dumps(list(dts.iter_gpio_usage_records()))))
+                self.assertEqual(query('phandle', '0x1'), dts.path(dts.find_node_by_phandle(1)))
+                self.assertEqual(query('phandle', '0x7fffffff'), None)
+                self.assertEqual(query('path', 'CPU0'), {'path': '/cpus/cpu@0', 'props': dts.label('CPU0').props,
+                                                         'subnodes': [node.name for node in dts.label('CPU0').subnodes]})
+                self.assertEqual(query('path', '/nonexist'), None)
+                soc = query('path', '/soc')['subnodes']
+                self.assertNotIn('slpi_pinctrl@02B40000', soc)
+                self.assertEqual(soc, [node.name for node in dts.subnodes(dts.node('/soc'))])
+                self.assertIn('slpi_pinctrl@02B40000', dtsparser.query_server(
+                    path, {'file': dts_file, 'query': 'path', 'arg': '/soc', 'with_disabled_node': True})['subnodes'])
+                self.assertEqual(query('pattern', 'cpu@[0-9]+'), ['/cpus/cpu@{}'.format(i) for i in range(0, 800, 100)])
+                self.assertEqual(query('select', 'cpus/*[reg=<0x0 0x100>]'), ['/cpus/cpu@100'])
+                self.assertEqual(query('dump', '/cpus/cpu@0/l2-cache'), dts.node('/cpus/cpu@0/l2-cache').dump())
+                self.assertRaises(ValueError, query, 'nonexist', '/')
+                self.assertRaises(ValueError, query, 'dump', '/nonexist')
+                self.assertRaises(ValueError, dtsparser.query_server, path, {'query': 'gpio_usage'})
+
+                tree = server.tree(dts_file)
+                os.utime(dts_file, ns=(0, 0))
+                self.assertTrue(server.tree(dts_file) is tree)
+                with open(dts_file, 'w') as fd:
+                    fd.write(text.replace('cpu@700 {', 'cpu@800 {'))
+                self.assertEqual(query('pattern', 'cpu@[78]00'), ['/cpus/cpu@800'])
+                self.assertFalse(server.tree(dts_file) is tree)
+            finally:
+                server.shutdown()
+                thread.join()
+            self.assertFalse(os.path.exists(path))
+
+    def test_process_dtb_dtc(self):
+        dts_file = os.path.abspath('mt6771-dtb-k71v1_64_bsp.dts')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dtc = os.path.join(tmpdir, 'dtc')
+            with open(dtc, 'w') as fd:
+                fd.write('#!/bin/sh\n[ "$*" = "-I dtb -O dts {0}/board.dtb" ] && cat {1}\n'.format(tmpdir, dts_file))
+            os.chmod(dtc, stat.S_IRWXU)
+            dtb_file = os.path.join(tmpdir, 'board.dtb')
+            dtb_file, result_file, error, output, stats = dtsparser.process_dtb(dtb_file, dtc)
+            self.assertEqual(error, None)
+            with open(result_file) as fd:
+                self.assertEqual(fd.read(), dtsparser.Dts(dts_file).dump_gpio_interrupt_pinctrl_usage())
+            error = dtsparser.process_dtb(os.path.join(tmpdir, 'other.dtb'), dtc)[2]
+            self.assertTrue(error.startswith('ValueError') and 'exit status 1' in error)
+
+    def test_include_graph(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = {'a.dts': '/dts-v1/;\n#include "b.dtsi"\n  #include "c.dtsi" /* c */\n/ { };\n',
+                     'b.dtsi': '#include "c.dtsi"\n#include "sub/d.dtsi"\n',
+                     'c.dtsi': '// #include "no.dtsi"\n#include "e.dtsi"\n#include <dt-bindings/gpio.h>\n',
+                     'e.dtsi': '#include "c.dtsi"\n',
+                     'sub/d.dtsi': '#include "f.dtsi"\n',
+                     'inc/f.dtsi': '',
+                     'x.dts': '#include "e.dtsi"\n'}
+            os.makedirs(os.path.join(tmpdir, 'sub'))
+            os.makedirs(os.path.join(tmpdir, 'inc'))
+            for name, text in files.items():
+                with open(os.path.join(tmpdir, name), 'w') as fd:
+                    fd.write(text)
+            path = lambda name: os.path.join(tmpdir, name)
+            graph = dtsparser.IncludeGraph(include_dirs=[path('inc')])
+            self.assertEqual(graph.includes(path('c.dtsi')), ['e.dtsi'])
+            self.assertEqual(graph.dtsi_check_order(path('a.dts')),
+                             ['a.dts', 'b.dtsi', 'c.dtsi', 'e.dtsi', 'c.dtsi', 'sub/d.dtsi', 'f.dtsi', 'c.dtsi', 'e.dtsi', 'c.dtsi'])
+            self.assertEqual(graph.reachable(path('a.dts')),
+                             [path('b.dtsi'), path('c.dtsi'), path('e.dtsi'), path('sub/d.dtsi'), path('inc/f.dtsi')])
+            self.assertEqual(graph.reachable(path('sub/d.dtsi')), [path('inc/f.dtsi')])
+            roots = [path('x.dts'), path('a.dts'), path('b.dtsi')]
+            self.assertEqual(graph.included_by(path('inc/f.dtsi'), roots), [path('a.dts'), path('b.dtsi')])
+            self.assertEqual(graph.included_by(path('c.dtsi'), roots), roots)
+            self.assertEqual(graph.included_by(path('a.dts'), roots), [])
+
+            with open(path('x.dts'), 'w') as fd:
+                fd.write('#include "sub/d.dtsi"\n')
+            os.utime(path('x.dts'), ns=(0, 0))
+            self.assertEqual(graph.includes(path('x.dts')), ['sub/d.dtsi'])
+            self.assertEqual(graph.included_by(path('inc/f.dtsi'), roots), roots)
+            self.assertEqual(dtsparser.IncludeGraph(jobs=1).includes(path('nonexist.dtsi')), [])
+
+            files = {'r1.dts': '#include "ca.dtsi"\n', 'ca.dtsi': '#include "cb.dtsi"\n#include "t.dtsi"\n',
+                     'cb.dtsi': '#include "ca.dtsi"\n', 'r2.dts': '#include "cb.dtsi"\n', 't.dtsi': ''}
+            for name, text in files.items():
+                with open(path(name), 'w') as fd:
+                    fd.write(text)
+            for roots in ([path('r1.dts'), path('r2.dts')], [path('r2.dts'), path('r1.dts')], [path('r2.dts')]):
+                self.assertEqual(graph.included_by(path('t.dtsi'), roots), roots)
+            self.assertEqual(graph.included_by(path('ca.dtsi'), [path('ca.dtsi'), path('t.dtsi')]), [path('ca.dtsi')])
+
+            files = {'a.dts': '/dts-v1/;\n#include "b.dtsi"\n', 'b.dtsi': '#include "c.dtsi"\n#include "c.dtsi"\n', 'c.dtsi': ''}
+            for name, text in files.items():
+                with open(path(name), 'w') as fd:
+                    fd.write(text)
+            output = subprocess.run(['bash', 'dtsi_check.sh', path('a.dts')], stdout=subprocess.PIPE,
+                                    universal_newlines=True).stdout
+            self.assertEqual(output.splitlines(), ['a.dts', 'b.dtsi', 'c.dtsi', 'c.dtsi'])
+
+    def test_scan_gpio_sources(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = {'a.dts': '/dts-v1/;\n#include "b.dtsi"\n&soc {\n\tqcom,pins = <&msm_gpio 12 0>;\n'
+                              '\tx = <&msm_gpio 5 0 &msm_gpio 5 1>;\n};\n',
+                     'b.dtsi': 'gpio = <&msm_gpio 112 0>, <&msm_gpio 55 0>;\ny = <&msm_gpio 7>;\nz = <&msm_gpio 5\t0>;',
+                     'msm8909-pinctrl.dtsi': 'pins = "gp 5", "gp 12";\n\tgp 7\n qcom,pin-func = <gp 55>;\n'}
+            path = lambda name: os.path.join(tmpdir, name)
+            for name, text in files.items():
+                with open(path(name), 'w') as fd:
+                    fd.write(text)
+            pinctrl = path('msm8909-pinctrl.dtsi')
+            locations = dtsparser.scan_gpio_sources([path('a.dts'), path('b.dtsi'), path('a.dts')], [pinctrl])
+            self.assertEqual(list(locations), [5, 12, 55, 112])
+            self.assertEqual(locations[5], [(path('a.dts'), 5, '\tx = <&msm_gpio 5 0 &msm_gpio 5 1>;'),
+                                            (path('b.dtsi'), 3, 'z = <&msm_gpio 5\t0>;'),
+                                            (pinctrl, 1, 'pins = "gp 5", "gp 12";')])
+            self.assertEqual(locations[55], [(path('b.dtsi'), 1, 'gpio = <&msm_gpio 112 0>, <&msm_gpio 55 0>;'),
+                                             (pinctrl, 3, ' qcom,pin-func = <gp 55>;')])
+            self.assertEqual(dtsparser.scan_gpio_sources([path('b.dtsi'), path('nonexist.dtsi')], gpios=range(50, 60)),
+                             {55: [(path('b.dtsi'), 1, 'gpio = <&msm_gpio 112 0>, <&msm_gpio 55 0>;')]})
+            output = subprocess.run(['bash', 'gpio_check.sh', path('a.dts'), '12'], stdout=subprocess.PIPE,
+                                    universal_newlines=True).stdout.splitlines()
+            self.assertEqual(len(output), 13 + 3 + 2)
+            self.assertEqual(output[5:10], ['checking gpio 5', '{}:5:\tx = <&msm_gpio 5 0 &msm_gpio 5 1>;'.format(path('a.dts')),
+                                            '{}:3:z = <&msm_gpio 5\t0>;'.format(path('b.dtsi')),
+                                            '{}:1:pins = "gp 5", "gp 12";'.format(pinctrl), 'checking gpio 6'])
+
+    def test_bench_synthetic_dts(self):
+        import bench_dtsparser
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dts_file = os.path.join(tmpdir, 'synthetic.dts')
+            with open(dts_file, 'w') as fd:
+                fd.write(bench_dtsparser.make_synthetic_dts(2))
+            dts = dtsparser.Dts(dts_file)
+            self.assertEqual(len(list(dts.iter_nodes())), 1 + 1 + 1 + 2 * (1 + 32 * 3) + 180)
+            self.assertEqual(dts.get_platform(), dtsparser.Platform.QUALCOMM)
+            usage = dts.get_gpio_interrupt_pinctrl_usage()
+            self.assertEqual(len(usage), 3)
+            for (gpio_nodeinfo, interrupt_nodeinfo, pinctrl_nodeinfo), used in zip(list(usage.values())[1:], [100, 80]):
+                self.assertEqual(len(gpio_nodeinfo), 16)
+                self.assertEqual(sum(len(nodeinfo) for nodeinfo in gpio_nodeinfo.values()), used)
+                self.assertEqual(sum(len(nodeinfo) for nodeinfo in interrupt_nodeinfo.values()), used)
+
 
 if __name__ == '__main__':
     #cProfile.run('unittest.main()')